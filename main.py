@@ -3,22 +3,33 @@ from utils import connect
 from utils import logmaster
 from utils import prettyprint
 from utils import classteachers
-from utils import gui
+from utils import assignteachers
+from utils import engine
+from utils import multistart
+from utils import optimize
+from utils import reschedule
+from utils import substitute
+from utils import query
+from utils import persist
+from utils import problem as prob
+from utils import instrument
+from utils import progress
 from math import fabs
+import argparse
+import json
 
 # =================== TODO ====================
 # Important: Assign class teachers w.r.t previous year data
-# Important: pair_subject assignment in the same period
-#            the 9th grade and 10th grade errors should fix themselves after this
 # Feature:   First period is always of class teacher
 
 # Global variables
-sql_conn = connect.connect_to_db()
+sql_conn = connect.shared
 log = logmaster.getLogger()
 
 # I'll take two. Thank you
-cursor_read = sql_conn.cursor(buffered=True)
-cursor_write = sql_conn.cursor()
+# Nothing connects to the database until these are first used
+cursor_read = connect.LazyCursor(buffered=True)
+cursor_write = connect.LazyCursor()
 
 # Returns period(ID)
 # @param day    -- day Eg: "mon", "tue" ...
@@ -38,19 +49,27 @@ def get_teacher(class_name: str, subject: str):
 
 # Verifies that the total number of periods assigned per week for a class
 # is actually equal to the number of periods that can exist in a week.
+@instrument.timed
 def check_subject_grade_assignments(max_val):
     log.info("Checking periods assignments for all classes...")
     # Clearly needs an explanation, this one...
     # The query returns the class and the total number of periods that class is assigned in a week
     # I subject_teachers LEFT JOIN periods when the grade and subject are the same in both tables
-    # But subject_teachers doesn't have grade, it has class. So I have to extract just the number leaving the section.
+    # But subject_teachers doesn't have grade, it has class. So the grade comes from table classes.
+    # The subjects of an elective group are taught at the same time, so a group counts once, as its longest subject.
     cursor_read.execute("""
-        SELECT subject_teachers.class, SUM(periods_per_week.per_week)
-        FROM subject_teachers LEFT JOIN periods_per_week
-            ON 
-                SUBSTRING(subject_teachers.class, 1, LENGTH(subject_teachers.class) - 1) = periods_per_week.grade
-            AND subject_teachers.subject = periods_per_week.subject 
-        GROUP BY subject_teachers.class;
+        SELECT units.class, SUM(units.per_week)
+        FROM (
+            SELECT subject_teachers.class, MAX(periods_per_week.per_week) AS per_week
+            FROM subject_teachers
+                JOIN classes ON classes.ID = subject_teachers.class
+                LEFT JOIN periods_per_week
+                ON 
+                    classes.grade = periods_per_week.grade
+                AND subject_teachers.subject = periods_per_week.subject 
+            GROUP BY subject_teachers.class, COALESCE(subject_teachers.elective_group, subject_teachers.subject)
+        ) AS units
+        GROUP BY units.class;
     """)
 
     for i in cursor_read.fetchall():
@@ -67,10 +86,11 @@ def get_class_teacher(class_name: str):
     return result[0][0] if result else None
 
 # Creates the timetable. A single table that stores all the data on it
+@instrument.timed
 def init_timetable_template():
     cursor_write.execute("DROP TABLE IF EXISTS timetable;")
     cursor_write.execute("""CREATE TABLE timetable (
-            class   VARCHAR(3) NOT NULL,
+            class   VARCHAR(8) NOT NULL,
             subject VARCHAR(4),
             teacher VARCHAR(4),
             period  TINYINT NOT NULL,
@@ -80,8 +100,20 @@ def init_timetable_template():
             FOREIGN KEY (period)  REFERENCES periods(ID)  ON UPDATE CASCADE ON DELETE NO ACTION
         ) Engine = InnoDB;
     """)
+    # For looking up a period by class or by teacher and period, as the SQL engine and ad-hoc queries do
+    cursor_write.execute("CREATE INDEX timetable_class_period ON timetable (class, period);")
+    cursor_write.execute("CREATE INDEX timetable_period_teacher ON timetable (period, teacher);")
     log.debug("Created table timetables.")
 
+# Creates the timetable if there isn't one, keeping it if there is.
+# Creating a table commits on MySQL, so this is done before anything that should be rolled back
+def ensure_timetable_table():
+    try:
+        cursor_read.execute("SELECT 1 FROM timetable LIMIT 1;")
+        cursor_read.fetchall()
+    except connect.Error:
+        init_timetable_template()
+
 # Checks if a period is available in both teacher's and class's timetable
 # @param period     -- ID of period
 # @param class_name -- ID of class 
@@ -124,14 +156,17 @@ def get_periods(quantity: int, class_name: str, teacher: str, day: str, search_s
 # A special requirement of our school that 2 of these 'Co-Curricular Activity', or CCA periods
 # be assigned on the same periods for the whole school in a week. Assigned to class teacher.
 # The first two periods on a saturday.
-def assign_cca_periods():
+#
+# @param writer -- The persist.TimetableWriter to write with
+def assign_cca_periods(writer: persist.TimetableWriter):
+    # get_period_id() uses cursor_read too, so look the periods up before the classes
+    cca_periods = [get_period_id("sat", 1), get_period_id("sat", 2)]
     cursor_read.execute("SELECT ID, teacher FROM classes;")
 
     for i in cursor_read.fetchall():
-        cursor_write.execute("INSERT INTO timetable VALUES (%s, %s, %s, %s), (%s, %s, %s, %s);",
-            [i[0], "CCA", i[1], get_period_id("sat", 1),
-             i[0], "CCA", i[1], get_period_id("sat", 2)])
-    sql_conn.commit()
+        for period_id in cca_periods:
+            writer.insert(i[0], "CCA", i[1], period_id)
+    writer.flush()
 
 # Updates the timetable assignment cache
 # This is cache to store important details about previous assignments
@@ -168,9 +203,15 @@ def check_cache(cache: dict, class_name: str, value):
         return False
 
 # We create the timetable lah...
+# All of it is written in a single transaction. If anything goes wrong, nothing is saved.
+@instrument.timed
 def create_timetable():
+    with persist.TimetableWriter(sql_conn) as writer:
+        _create_timetable(writer)
+
+def _create_timetable(writer: persist.TimetableWriter):
      # Assign CCA periods to the class teacher.
-    assign_cca_periods()
+    assign_cca_periods(writer)
 
     unassigned = [] # List of (class, teacher) tuples for unassigned periods
     
@@ -203,7 +244,7 @@ def create_timetable():
         cursor_read.execute("SELECT COUNT(*) FROM timetable WHERE class = %s AND subject = %s;", [class_name, subject])
         already_assigned = cursor_read.fetchall()[0][0]
         # The number of periods per week
-        cursor_read.execute("SELECT per_week FROM periods_per_week WHERE grade = %s AND subject = %s;", [int(class_name[:-1]), subject])
+        cursor_read.execute("SELECT per_week FROM periods_per_week WHERE grade = %s AND subject = %s;", [prob.grade_of(class_name), subject])
         remaining_periods = cursor_read.fetchall()[0][0] - already_assigned
 
         # Whether this subject can be assigned block periods
@@ -257,8 +298,7 @@ def create_timetable():
 
                     # Update `timetable` with obtained values of period ID
                     for period_id in periods:
-                        #log.debug("INSERT INTO timetable VALUES (%s, %s, %s, %s);", class_name, subject, teacher, period_id)
-                        cursor_write.execute("INSERT INTO timetable VALUES (%s, %s, %s, %s);", [class_name, subject, teacher, period_id])
+                        writer.insert(class_name, subject, teacher, period_id)
 
                 # Necessary as remaining_periods may go into negative before the next
                 # check in the while loop. Can't go into negative due to double decrements
@@ -266,7 +306,11 @@ def create_timetable():
                 # nears low values
                 if remaining_periods <= 0:
                     break
-            
+
+            # Periods placed on a day are only looked at again in the next attempt,
+            # so they need to reach the database by then.
+            writer.flush()
+
             if remaining_periods <= 0:
                 break
             else:
@@ -277,11 +321,9 @@ def create_timetable():
         if attempts >= max_attempts:
             log.info("Ran out of attempts: Class '%s' subject '%s' taught by '%s'.", class_name, subject, teacher)
 
-        sql_conn.commit()
-
         cursor_read.execute("SELECT COUNT(*) FROM timetable WHERE class = %s AND subject = %s;", [class_name, subject])
         periods_assigned = cursor_read.fetchall()[0][0]
-        cursor_read.execute("SELECT per_week FROM periods_per_week WHERE grade = %s AND subject = %s;", [int(class_name[:-1]), subject])
+        cursor_read.execute("SELECT per_week FROM periods_per_week WHERE grade = %s AND subject = %s;", [prob.grade_of(class_name), subject])
         max_periods = cursor_read.fetchall()[0][0]
         if periods_assigned != max_periods:
             unassigned.append((class_name, teacher))
@@ -293,8 +335,8 @@ def create_timetable():
 
     log.info("Totally, %s periods off. Fixing...", [missing_periods])
 
-    assign_unassigned(unassigned)
-    check_timetable()
+    assign_unassigned(unassigned, writer)
+    check_timetable(writer)
 
     # A final evaluation of the timetable assignments for this class
     # Just checking if the assigned periods and the total periods in a week match
@@ -303,7 +345,7 @@ def create_timetable():
         cursor_read.execute("SELECT COUNT(*) FROM timetable WHERE class = %s AND subject = %s;", [class_name, subject])
         periods_assigned = cursor_read.fetchall()[0][0]
         
-        cursor_read.execute("SELECT per_week FROM periods_per_week WHERE grade = %s AND subject = %s;", [int(class_name[:-1]), subject])
+        cursor_read.execute("SELECT per_week FROM periods_per_week WHERE grade = %s AND subject = %s;", [prob.grade_of(class_name), subject])
         max_periods = cursor_read.fetchall()[0][0]
         
         if periods_assigned != max_periods:
@@ -324,22 +366,6 @@ def get_class_timetable(clss: str):
     cursor_read.execute("SELECT period, subject, teacher FROM timetable WHERE class = %s ORDER BY period;", [clss])
     return [list(row) for row in cursor_read.fetchall()]
 
-# Checks if a period is part of a block period
-#
-# @param period -- The period ID
-# @param tt     -- The timetable of the class as a list of lists
-def is_block(period: int, tt: list):
-    for i in range(len(tt)):
-        if tt[i][0] == period:
-            # Check if the next period is also assigned to the same subject
-            if i + 1 < len(tt):
-                if tt[i + 1][1] == tt[i][1]:
-                    return True
-                if i - 1 > 0:
-                    if tt[i - 1][1] == tt[i][1]:
-                        return True
-    return False
-
 # Gets all the free periods for a teacher
 #
 # @param teacher -- The teacher's ID
@@ -364,98 +390,40 @@ def get_unassigned_periods(tt: list):
     present_periods = {i[0] for i in tt}
     return sorted(all_periods - present_periods)
 
-# Caches subject for each teacher to avoid repeated DB queries
-_subject_cache = {}
-
-# Loads the teacher-subject cache
-def load_teacher_subject_cache():
-    cursor_read.execute("SELECT ID, subject FROM teachers;")
-    global _subject_cache
-    _subject_cache = {teacher: subject for teacher, subject in cursor_read.fetchall()}
-
-# Gets subject for a teacher from cache
-#
-# @param teacher -- The teacher ID
-def get_subject_for_teacher(teacher: str):
-    if teacher in _subject_cache:
-        return _subject_cache[teacher]
-    return None
-
 # This is my attempt at solving the teacher-class-availability paradox.
 # Fingers crossed.
+#
+# It used to try single swaps within a class. Now the timetable is loaded into memory and
+# engine.repair() places the periods, swapping along whole chains of classes and teachers
+# if need be. See engine.py. Only what changed is written back.
 
 # Function to assign unassigned periods.
 #
-# @param periods_to_be_assigned -- List of (class, teacher) tuples
-def assign_unassigned(periods_to_be_assigned: list):      # lol
-    # class_data = [(class, teacher), ...]
-    # Get all classes and their class teachers
-    cursor_read.execute("SELECT ID, teacher FROM classes;")
-    class_data = cursor_read.fetchall()
-    # periods that are first periods and CCA (cannot be swapped)
-    first_periods = [1, 9, 17, 25, 33, 41, 42]
-    swap_log = []
-
-    # Cache free periods for all teachers
-    cursor_read.execute("SELECT DISTINCT teacher FROM timetable;")
-    all_teachers = [t[0] for t in cursor_read.fetchall()]
-    teacher_free_cache = {t: get_free_periods(t) for t in all_teachers}
-
-    # Cached version of is_free()
-    def is_free_cached(period, teacher):
-        return period in teacher_free_cache.get(teacher, [])
-
-    # For each class in the school
-    for cls, _ in class_data:
-        # List of periods to be assigned for this class
-        class_unassigned = [i for i in periods_to_be_assigned if i[0] == cls]
-        if not class_unassigned:
-            continue
-
-        # timetable = [[period, subject, teacher], ...]
-        timetable = get_class_timetable(cls)
-        empty_periods = get_unassigned_periods(timetable)
-        # unassigned = [(class, teacher), ...]
-
-        # This is the main logic of the function. It checks if the teacher teaching the unassigned period
-        # is free in an already assigned period of the class and if the teacher teaching that assigned period
-        # is free in any of the unassigned periods of the class. If both conditions are satisfied,
-        # the periods are swapped.
-        for _, tr in class_unassigned:
-            for j in range(1, 49):
-                if j in first_periods or j in empty_periods or is_block(j, timetable):
-                    continue
-                else:
-                    curr_teacher = [i[2] for i in timetable if i[0] == j]
-                    if not curr_teacher:
-                        continue
-                    curr_teacher = curr_teacher[0]
-
-                    if not is_free_cached(j, tr):
-                        continue
-
-                    for period_id in empty_periods:
-                        if is_free_cached(period_id, curr_teacher):
-                            # Swap periods
-                            cursor_write.execute("UPDATE timetable SET teacher = %s WHERE class = %s AND period = %s;", [tr, cls, j])
-                            cursor_write.execute("INSERT INTO timetable VALUES(%s, %s, %s, %s);", [cls, get_subject_for_teacher(curr_teacher), curr_teacher, period_id])
-                            swap_log.append((cls, j, tr, period_id, curr_teacher))
-
-                            empty_periods.remove(period_id)
-                            teacher_free_cache[tr].remove(j)
-                            teacher_free_cache[curr_teacher].remove(period_id)
-                            break
-    
-    # Save changes to db
-    sql_conn.commit()
-    # Log swaps
-    for cls, j, tr, period_id, curr_teacher in swap_log:
-        log.info(f"Swapped {tr} into {cls} period {j}, moved {curr_teacher} to period {period_id}")
-
+# @param periods_to_be_assigned -- List of (class, teacher) tuples. Only the classes matter;
+#                                  all missing periods of these classes are assigned.
+# @param writer                 -- The persist.TimetableWriter to write with
+@instrument.timed
+def assign_unassigned(periods_to_be_assigned: list, writer: persist.TimetableWriter):      # lol
+    writer.flush()
+    problem = prob.load_problem(cursor_read)
+    tt = engine.load_timetable(cursor_read, problem)
+    before = tt.copy_cells()
+
+    classes = {cls for cls, _ in periods_to_be_assigned}
+    missing = [period for period in engine.find_missing(problem, tt) if period[0] in classes]
+    still_missing = engine.repair(tt, missing)
+    log.info("Assigned %s of %s unassigned periods.", len(missing) - len(still_missing), len(missing))
+
+    # Save changes to db. They are committed along with the rest of the timetable.
+    engine.write_changes(writer, problem, before, tt)
+    writer.flush()
 
 # A final check of the timetable to ensure all periods are assigned
 # If any are still unassigned, fix those as well.
-def check_timetable():
+#
+# @param writer -- The persist.TimetableWriter to write with
+@instrument.timed
+def check_timetable(writer: persist.TimetableWriter):
     # Get all classes
     cursor_read.execute("SELECT ID FROM classes;")
     all_classes = [i[0] for i in cursor_read.fetchall()]
@@ -470,7 +438,7 @@ def check_timetable():
 
         # If there are unassigned periods...
         if unassigned_periods:
-            cursor_read.execute("SELECT subject, per_week FROM periods_per_week WHERE grade = %s;", [int(cls[:-1])])
+            cursor_read.execute("SELECT subject, per_week FROM periods_per_week WHERE grade = %s;", [prob.grade_of(cls)])
             subject_data = cursor_read.fetchall()
             # Get the subject and required number of periods for each unassigned period
             for subject, per_week in subject_data:
@@ -484,14 +452,60 @@ def check_timetable():
                     # Append (class, teacher) tuples for each unassigned period
                     for i in range(number_unassigned):
                         unassigned.append((cls, teacher))
-                    log.info(f"Class {cls} has {number_unassigned} unassigned periods for subject {subject} taught by {teacher}.")
+                    log.info("Class %s has %s unassigned periods for subject %s taught by %s.", cls, number_unassigned, subject, teacher)
     
     # If there are unassigned periods, assign them
     if unassigned:
-        assign_unassigned(unassigned)
+        assign_unassigned(unassigned, writer)
 
 # ----------- PARADOX FIX ENDS -----------
 
+# Makes a new timetable from scratch
+#
+# @param solver     -- "memory" to do all the work in memory and save the timetable in one go (fast)
+#                      "sql" to check every period against the database as it goes (the original).
+#                            It can't schedule elective groups; raises ValueError if there are any
+#                      "cp" to have a constraint solver find a complete timetable (needs OR-Tools).
+#                            Raises ValueError if it finds none
+# @param time_limit -- Seconds the "cp" solver may take
+# @param starts     -- For "memory", make this many timetables on all cores and keep the best
+# @param moves      -- For "memory" and "cp", try to improve the timetable with this many moves. See optimize.py
+@instrument.timed
+def generate_timetable(solver: str = "memory", time_limit: float = 60.0, starts: int = 1, moves: int = 0):
+    check_subject_grade_assignments(6 * 8)
+
+    if solver == "sql":
+        # The SQL engine places each subject of an elective group on its own, which isn't a valid timetable
+        cursor_read.execute("SELECT COUNT(*) FROM subject_teachers WHERE elective_group IS NOT NULL;")
+        if cursor_read.fetchone()[0]:
+            raise ValueError("The sql solver can't schedule elective groups. Use the memory or cp solver.")
+
+        # Create an empty timetable
+        init_timetable_template()
+        create_timetable()
+        return
+
+    # The other solvers work in memory and save the timetable in one go.
+    # The old timetable is only replaced once there is a new one, and in the same transaction
+    # the new one is saved in (see engine.save()), so a failed or cancelled run keeps it
+    ensure_timetable_table()
+    problem = prob.load_problem(cursor_read)
+    if solver == "cp":
+        # Imported only now, like the other optional modules below; OR-Tools takes a while to load
+        from utils import cpsolver
+        tt, missing = cpsolver.solve(problem, time_limit), [] # Raises ValueError if it finds none
+    elif starts > 1:
+        tt, missing = multistart.solve(problem, starts)
+    else:
+        tt, missing = engine.solve(problem)
+
+    if moves:
+        optimize.optimize(problem, tt, moves)
+    progress.report("saving", unassigned = len(missing))
+    engine.save(sql_conn, problem, tt)
+    from utils import metrics # Needs NumPy
+    log.info("Timetable metrics: %s", metrics.summary(metrics.measure(problem, tt)))
+
 def main():
     # Prompt: Update database records?
     if input("Would you like to update the database with newer records? [Y/n] ") in "Yy":
@@ -505,24 +519,300 @@ def main():
 
     # Prompt: Make a new timetable?
     if input("Would you like to make a new timetable? [Y/n] ") in "Yy":
-        # Create an empty timetable
-        init_timetable_template()
-        check_subject_grade_assignments(6 * 8)
-        load_teacher_subject_cache()
-        create_timetable()
+        generate_timetable()
         print("Timetable updated.")
     else:
         print("Not updating the timetable.")
     
     # Prompt: Save timetables to file?
     if input("Would you like to save the timetables to file? [Y/n] ") in "Yy":
-        prettyprint.class_timetables("ctt.csv")
-        prettyprint.teachers_timetables("ttt.csv")
+        prettyprint.export("ctt.csv", "ttt.csv", "timetable.snap")
         print("Timetables saved.")
     else:
         print("Not saving timetables to csv.")
 
+    connect.close_connection()
+    instrument.save()
+
     # Show GUI for viewing timetables
-    gui.main()
+    # Imported only now; tkinter takes a while to load
+    from utils import gui
+    gui.main(generate_and_export)
+
+# What the GUI's Generate button runs, in a thread of its own. See gui.py
+# Reports its progress through progress.py and can be cancelled through it until it reports "saving".
+def generate_and_export():
+    try:
+        generate_timetable()
+        prettyprint.export("ctt.csv", "ttt.csv", "timetable.snap")
+    finally:
+        # The connection belongs to this thread
+        connect.close_connection()
+
+# What the GUI's Load button runs, in a thread of its own, like generate_and_export().
+# Loads the CSV files and assigns subject and class teachers. Cancelling it leaves the data partly loaded.
+#
+# @param data_dir  -- Directory of the CSV files
+# @param ct_method -- See classteachers.assign_class_teachers()
+# @param ct_file   -- See classteachers.assign_class_teachers()
+def load_and_assign(data_dir: str = "data", ct_method: str = "random", ct_file: str = None):
+    try:
+        db.update_db(data_dir)
+        progress.report("assigning class teachers")
+        classteachers.assign_class_teachers(ct_method, ct_file)
+    finally:
+        connect.close_connection()
+
+# ----------- COMMAND LINE -----------
+#
+# For running without anyone around to answer prompts. Eg:
+#
+#     python main.py --config batch.json run
+#     python main.py load --choose HIN/SAN=HIN --choose 9A:HIN/SAN=SAN
+#     python main.py generate --solver sql
+#
+# Every option can also be given in the JSON file passed to --config, under the same
+# name (with underscores). Options on the command line win over the config file.
+# Without a command, the prompts of main() are shown as usual.
 
-main()
+# Reads `[CLASS:]OPTIONS=SUBJECT` answers to optional subject choices into the format
+# db.set_optional_subjects() takes
+#
+# @param values -- List of strings. Eg: ["HIN/SAN=HIN", "9A:HIN/SAN=SAN"]
+def parse_choices(values: list):
+    choices = {}
+    for value in values:
+        options, _, subject = value.partition("=")
+        class_name, _, options = options.rpartition(":")
+        if not options or not subject:
+            raise ValueError(f"Invalid choice '{value}'. Expected [CLASS:]OPTIONS=SUBJECT")
+        choices.setdefault(class_name or "*", {})[options] = subject
+    return choices
+
+# Reads `A:B=C` changes for the reschedule command into a list of (A, B, C)
+#
+# @param values -- List of strings. Eg: ["9A:MAT=T012"]
+# @param form   -- What a value should look like, for the error message
+def parse_changes(values: list, form: str):
+    changes = []
+    for value in values:
+        key, _, new = value.partition("=")
+        first, _, second = key.partition(":")
+        if not first or not second or not new:
+            raise ValueError(f"Invalid change '{value}'. Expected {form}")
+        changes.append((first, second, new))
+    return changes
+
+def build_parser():
+    # Options shared by the commands that use them, and by `run`
+    load_options = argparse.ArgumentParser(add_help=False)
+    load_options.add_argument("--data-dir", help="directory having the CSV files (default: data)")
+    load_options.add_argument("--choose", action="append", metavar="[CLASS:]OPTIONS=SUBJECT",
+                              help="pre-answer a choice between optional subjects. Eg: HIN/SAN=HIN or 9A:HIN/SAN=SAN. "
+                                   "Unanswered choices, or HIN/SAN=HIN/SAN, take all of them as an elective group taught at the same time")
+
+    ct_options = argparse.ArgumentParser(add_help=False)
+    ct_options.add_argument("--ct-method", choices=["file", "promote", "random"], help="how to assign class teachers (default: random)")
+    ct_options.add_argument("--ct-file", help="CSV file having the class teachers, for --ct-method file")
+
+    generate_options = argparse.ArgumentParser(add_help=False)
+    generate_options.add_argument("--solver", choices=["memory", "sql", "cp"], help="timetable engine to use (default: memory)")
+    generate_options.add_argument("--time-limit", type=float, help="seconds the cp solver may take (default: 60)")
+    generate_options.add_argument("--starts", type=int, help="make this many timetables on all cores and keep the best, with the memory solver (default: 1)")
+    generate_options.add_argument("--optimize", type=int, dest="moves", metavar="MOVES",
+                                  help="try to improve the timetable with this many moves, with the memory and cp solvers (default: 0)")
+
+    export_options = argparse.ArgumentParser(add_help=False)
+    export_options.add_argument("--classes-file", help="where to save class timetables (default: ctt.csv)")
+    export_options.add_argument("--teachers-file", help="where to save teacher timetables (default: ttt.csv)")
+    export_options.add_argument("--snapshot-file", help="where to save the snapshot the GUI reads (default: timetable.snap)")
+
+    parser = argparse.ArgumentParser(description="Generates school timetables. Asks what to do if no command is given.")
+    parser.add_argument("--config", help="JSON file with options, so they needn't be passed every time")
+    parser.add_argument("--stats", dest="stats_file", metavar="FILE", help="where to save the timings and SQL counts of the run (default: next to the log)")
+    parser.add_argument("--no-cache", action="store_true", help="load the timetable problem from the database even if it hasn't changed")
+    parser.add_argument("--max-load", type=int, metavar="PERIODS", help="most periods a week a teacher is given when assigning subject teachers (default: every slot of the week)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="lowest level of messages logged (default: INFO)")
+    parser.add_argument("--log-file", metavar="FILE", help="where to log (default: a new file in logs/). Rotated once it reaches log_max_bytes of the config file (default: 10 MB)")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.add_parser("load", parents=[load_options], help="load the CSV files into the database and assign subject teachers")
+    commands.add_parser("assign-teachers", help="assign subject teachers to every class again")
+    commands.add_parser("assign-class-teachers", parents=[ct_options], help="assign class and co class teachers")
+    commands.add_parser("generate", parents=[generate_options], help="make a new timetable")
+    commands.add_parser("export", parents=[export_options], help="save class and teacher timetables to CSV files")
+    commands.add_parser("gui", parents=[load_options, ct_options], help="view the timetables, and load data and make new timetables, in a window")
+    commands.add_parser("run", parents=[load_options, ct_options, generate_options, export_options],
+                        help="load, assign-class-teachers, generate and export in one go")
+    reschedule_parser = commands.add_parser("reschedule", help="apply changes and update the saved timetable, moving as few periods as possible")
+    reschedule_parser.add_argument("--replace", action="append", default=[], metavar="CLASS:SUBJECT=TEACHER",
+                                   help="give a class a new teacher for a subject. Eg: 9A:MAT=T012")
+    reschedule_parser.add_argument("--per-week", action="append", default=[], metavar="GRADE:SUBJECT=PERIODS",
+                                   help="change the periods per week of a subject for a grade. Eg: 9:PHY=6")
+    reschedule_parser.add_argument("--leaves", action="append", default=[], metavar="TEACHER",
+                                   help="hand a leaving teacher's classes to other teachers of the subject")
+    substitute_parser = commands.add_parser("substitute", help="find substitutes for absent teachers on a day")
+    substitute_parser.add_argument("day", choices=prob.DAYS, help="day of the absence")
+    substitute_parser.add_argument("absent", nargs="+", metavar="TEACHER", help="IDs of the absent teachers")
+    substitute_parser.add_argument("--file", help="where to save the substitutions (default: substitutions.csv)")
+    query_parser = commands.add_parser("query", help="look up who is free when in the saved timetable")
+    lookups = query_parser.add_subparsers(dest="lookup", metavar="lookup", required=True)
+    for name, text in (("free-teachers", "teachers with no period at a time"),
+                       ("free-classes", "classes with no period at a time"),
+                       ("busy-classes", "classes having a period at a time, with subject and teacher")):
+        lookup = lookups.add_parser(name, help=text)
+        lookup.add_argument("day", choices=prob.DAYS)
+        lookup.add_argument("period", type=int, choices=range(1, prob.PERIODS_PER_DAY + 1))
+    lookups.add_parser("teacher", help="the periods of a teacher").add_argument("teacher")
+    lookups.add_parser("free-with", help="the other classes free whenever a class is free").add_argument("class_name", metavar="class")
+    metrics_parser = commands.add_parser("metrics", help="measure how good the saved timetable is")
+    metrics_parser.add_argument("--json", dest="metrics_file", metavar="FILE", help="also save the measures, per class and per teacher too, to a JSON file")
+    benchmark_parser = commands.add_parser("benchmark", help="time everything on made up schools of several sizes. Doesn't touch your database")
+    benchmark_parser.add_argument("--sections", type=int, nargs="+", default=[2, 4, 8], metavar="N", help="sizes to try, as sections per grade (default: 2 4 8)")
+    benchmark_parser.add_argument("--grades", default="6-12", metavar="FIRST-LAST", help="grades of the made up schools (default: 6-12)")
+    benchmark_parser.add_argument("--teacher-load", type=int, default=30, help="periods a week per teacher, which decides how many there are (default: 30)")
+    benchmark_parser.add_argument("--campuses", type=int, default=1, help="campuses of the made up schools, each with all the grades and sections (default: 1)")
+    benchmark_parser.add_argument("--electives", type=float, default=0.5, help="share of classes choosing between optional subjects (default: 0.5)")
+    benchmark_parser.add_argument("--no-sql", dest="sql", action="store_false", help="don't time the original SQL engine, which is slow on big schools")
+    benchmark_parser.add_argument("--dir", dest="benchmark_dir", default="benchmark", help="where to put the made up schools (default: benchmark)")
+    benchmark_parser.add_argument("--json", dest="benchmark_file", metavar="FILE", help="also save the results to a JSON file")
+    return parser
+
+# Runs a command given on the command line. Returns the exit status.
+#
+# @param args -- The parsed arguments
+def run_command(args):
+    config = {}
+    if args.config:
+        with open(args.config) as file:
+            config = json.load(file)
+
+    # The option from the command line if given, else from the config file, else `default`
+    def option(name: str, default = None):
+        value = getattr(args, name, None)
+        return value if value is not None else config.get(name, default)
+
+    try:
+        logmaster.configure(option("log_level"), option("log_file"), option("log_max_bytes"), option("log_backups"))
+    except ValueError as err:
+        print(err)
+        return 2
+    if args.no_cache or config.get("no_cache"):
+        prob.CACHE_DIR = None
+    status = 0 # 1 if a command ran but left something undone
+    if option("max_load") is not None:
+        assignteachers.MAX_LOAD = option("max_load")
+
+    if args.command in ("load", "run", "gui"):
+        choices = config.get("optional_subjects", {})
+        try:
+            from_command_line = parse_choices(option("choose", []))
+        except ValueError as err:
+            log.error(err)
+            return 2
+        for class_name, answers in from_command_line.items():
+            choices.setdefault(class_name, {}).update(answers)
+        db.set_optional_subjects(choices, interactive = False)
+
+    if args.command in ("load", "run"):
+        db.update_db(option("data_dir", "data"))
+
+    if args.command == "assign-teachers":
+        assignteachers.assign_teachers()
+
+    if args.command in ("assign-class-teachers", "run"):
+        method = option("ct_method", "random")
+        if method == "file" and not option("ct_file"):
+            log.error("--ct-method file needs --ct-file.")
+            return 2
+        classteachers.assign_class_teachers(method, option("ct_file"))
+
+    if args.command in ("generate", "run"):
+        try:
+            generate_timetable(option("solver", "memory"), option("time_limit", 60.0), option("starts", 1), option("moves", 0))
+        except ValueError as err:
+            log.error(err)
+            return 2
+
+    if args.command == "reschedule":
+        try:
+            replacements = parse_changes(args.replace, "CLASS:SUBJECT=TEACHER")
+            per_week = [(int(grade), subject, int(periods)) for grade, subject, periods in parse_changes(args.per_week, "GRADE:SUBJECT=PERIODS")]
+        except ValueError as err:
+            log.error(err)
+            return 2
+        try:
+            _, still_missing = reschedule.reschedule(sql_conn, replacements, per_week, args.leaves)
+        except ValueError as err:
+            log.error(err)
+            return 2
+        # The timetable is saved even so; whoever runs this has to place these by hand
+        for class_name, subject, teacher in still_missing:
+            print(f"Unassigned: {class_name} {subject} {teacher}")
+        if still_missing:
+            status = 1
+
+    if args.command == "substitute":
+        problem, tt, serials = substitute.load(cursor_read)
+        substitute.save(option("file", "substitutions.csv"), substitute.find_substitutes(problem, tt, serials, args.absent, args.day))
+
+    if args.command == "query":
+        index = query.load(cursor_read)
+        if args.lookup == "free-teachers":
+            print(" ".join(index.free_teachers_at(args.day, args.period)))
+        elif args.lookup == "free-classes":
+            print(" ".join(index.free_classes_at(args.day, args.period)))
+        elif args.lookup == "busy-classes":
+            for class_name, (subject, teacher) in index.busy_classes_at(args.day, args.period).items():
+                print(class_name, subject, teacher)
+        elif args.lookup == "teacher":
+            for day, period, class_name in index.teacher_periods(args.teacher):
+                print(day, period, class_name)
+        else:
+            for day, period, classes in index.free_with(args.class_name):
+                print(day, period, " ".join(classes))
+
+    if args.command == "metrics":
+        from utils import metrics # Needs NumPy, which takes a while to load
+        problem = prob.load_problem(cursor_read)
+        measures = metrics.measure(problem, engine.load_timetable(cursor_read, problem))
+        for key, value in metrics.summary(measures).items():
+            print(f"{key:<13}{value}")
+        if option("metrics_file"):
+            with open(option("metrics_file"), "w") as file:
+                json.dump(measures, file, indent=4)
+
+    if args.command == "benchmark":
+        first, _, last = args.grades.partition("-")
+        try:
+            grades = range(int(first), int(last or first) + 1)
+        except ValueError:
+            log.error("Invalid grades '%s'. Expected FIRST-LAST, like 6-12", args.grades)
+            return 2
+        from utils import benchmark
+        results = benchmark.run(args.sections, generate_timetable, args.benchmark_dir, grades, args.teacher_load, args.electives, args.sql, args.campuses)
+        print(benchmark.report(results))
+        if args.benchmark_file:
+            with open(args.benchmark_file, "w") as file:
+                json.dump(results, file, indent=4)
+
+    if args.command in ("export", "run"):
+        prettyprint.export(option("classes_file", "ctt.csv"), option("teachers_file", "ttt.csv"), option("snapshot_file", "timetable.snap"))
+
+    if args.command == "gui":
+        # Imported only now; tkinter takes a while to load
+        from utils import gui
+        gui.main(generate_and_export, lambda: load_and_assign(option("data_dir", "data"), option("ct_method", "random"), option("ct_file")))
+
+    connect.close_connection()
+    instrument.save(option("stats_file"))
+    return status
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if args.command:
+        exit(run_command(args))
+    if args.log_level or args.log_file:
+        logmaster.configure(args.log_level, args.log_file)
+    if args.no_cache:
+        prob.CACHE_DIR = None
+    main()
@@ -0,0 +1,86 @@
+import csv
+import os
+import sys
+
+# main.py and utils/ are imported as they are when running main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from utils import classteachers
+from utils import connect
+from utils import db
+from utils import engine
+from utils import problem as prob
+from utils import sqlitedb
+from utils import synthetic
+
+# Loads a small made-up school (grades 9 and 10, two sections each) into a SQLite database
+# in the test's directory, with subject and class teachers, and makes it the shared
+# connection, closed after the test.
+#
+# The fixture is a function: school(electives = 0). Classes choosing between optional
+# subjects (the share of them is `electives`) are given no choice, so they take all the
+# options as an elective group.
+@pytest.fixture
+def school(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(prob, "CACHE_DIR", None)
+
+    def load(electives: float = 0):
+        synthetic.generate(str(tmp_path), range(9, 11), 2, electives = electives)
+        connect.set_connection(sqlitedb.connect(os.path.join(tmp_path, "timetable.db")))
+        db.set_optional_subjects({}, interactive = False)
+        db.update_db(str(tmp_path))
+
+        # Each class gets the first of its teachers who isn't a class teacher yet
+        cursor = connect.shared.cursor()
+        cursor.execute("SELECT class, teacher FROM subject_teachers WHERE teacher IS NOT NULL ORDER BY class, teacher;")
+        class_teachers = {}
+        for cls, teacher in cursor.fetchall():
+            if cls not in class_teachers and teacher not in class_teachers.values():
+                class_teachers[cls] = teacher
+        cursor.close()
+        with open(tmp_path / "classteachers.csv", "w", newline = "") as file:
+            writer = csv.writer(file)
+            writer.writerow(["class", "teacher"])
+            writer.writerows(class_teachers.items())
+        classteachers.assign_class_teachers("file", str(tmp_path / "classteachers.csv"))
+        return connect.shared
+
+    yield load
+    connect.close_connection()
+
+# Checks the timetable saved in the database against what the database says should be in
+# it: every class-subject combination has exactly its periods a week with its own teacher
+# (CCA with the class teacher), nothing else is in it, and no teacher (counting each teacher
+# of an elective group) has two classes at once. A class can't have two at once, as it has
+# one cell a slot.
+#
+# The fixture is a function: check_timetable(). Returns the timetable, as an engine.Timetable
+@pytest.fixture
+def check_timetable():
+    def check():
+        cursor = connect.shared.cursor()
+        problem = prob.load_problem(cursor)
+        tt = engine.load_timetable(cursor, problem)
+        cursor.close()
+
+        wanted = {(req.class_name, req.subject): req for req in problem.requirements}
+        counts = {}
+        for cls, row in tt.cells.items():
+            for slot, cell in enumerate(row):
+                if cell is None:
+                    continue
+                subject, teacher = cell
+                assert (cls, subject) in wanted, f"{cls} has {subject} in slot {slot}, which it doesn't take"
+                expected = problem.class_teachers[cls] if subject == "CCA" else wanted[(cls, subject)].teacher
+                assert teacher == expected, f"{cls} has {subject} with {teacher} in slot {slot}"
+                counts[(cls, subject)] = counts.get((cls, subject), 0) + 1
+        assert counts == {key: req.per_week for key, req in wanted.items() if req.per_week}
+
+        for slot in range(prob.SLOTS):
+            teachers = [teacher for row in tt.cells.values() if row[slot] for teacher in prob.members(row[slot][1]) if teacher]
+            assert len(teachers) == len(set(teachers)), f"A teacher has two classes in slot {slot}"
+        return tt
+
+    return check
@@ -0,0 +1,58 @@
+# Elective groups, on a small made-up school in a SQLite database where every class takes
+# each pair of optional subjects (Eg: FRE/SAN) as an elective group
+
+import pytest
+from utils import connect
+from utils import problem as prob
+import main
+
+# Checks that each period of a group is a row for each of its subjects, with its own teacher,
+# and books every one of its teachers. Returns the number of group periods
+def _check_groups(tt):
+    cursor = connect.shared.cursor()
+    cursor.execute("SELECT class, period, subject, teacher FROM timetable ORDER BY class, period, subject;")
+    rows = {}
+    for cls, period_id, subject, teacher in cursor.fetchall():
+        rows.setdefault((cls, period_id), []).append((subject, teacher))
+    problem = prob.load_problem(cursor)
+    cursor.close()
+
+    periods = 0
+    for cls, row in tt.cells.items():
+        for slot, cell in enumerate(row):
+            if cell is None or not prob.is_group(cell[0]):
+                continue
+            periods += 1
+            assert rows[(cls, problem.period_ids[slot])] == list(zip(prob.members(cell[0]), prob.members(cell[1])))
+            for teacher in prob.members(cell[1]):
+                assert tt.teacher_cells[teacher][slot] == cls
+    return periods
+
+def test_memory_engine(school, check_timetable):
+    school(electives = 1)
+    main.generate_timetable("memory")
+
+    tt = check_timetable()
+    assert _check_groups(tt) > 0
+
+def test_cp_solver(school, check_timetable):
+    pytest.importorskip("ortools")
+    school(electives = 1)
+    main.generate_timetable("cp", time_limit = 30)
+
+    tt = check_timetable()
+    assert _check_groups(tt) > 0
+
+def test_sql_solver_refuses_groups(school, check_timetable):
+    school(electives = 1)
+    main.generate_timetable("memory")
+    cursor = connect.shared.cursor()
+    cursor.execute("SELECT * FROM timetable ORDER BY class, period, subject;")
+    before = cursor.fetchall()
+
+    with pytest.raises(ValueError):
+        main.generate_timetable("sql")
+    cursor.execute("SELECT * FROM timetable ORDER BY class, period, subject;")
+    assert cursor.fetchall() == before
+    cursor.close()
+    check_timetable()
@@ -0,0 +1,62 @@
+# The in-memory engine, on a small made-up school in a SQLite database
+
+from utils import connect
+from utils import engine
+from utils import problem as prob
+import main
+
+def test_memory_engine_fills_every_period(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+
+    tt = check_timetable()
+    for cls, teacher in prob.load_problem(connect.shared.cursor()).class_teachers.items():
+        assert [tt.cells[cls][slot] for slot in engine.CCA_SLOTS] == [("CCA", teacher)] * 2
+
+def test_memory_engine_replaces_the_old_timetable(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+    main.generate_timetable("memory")
+
+    check_timetable()
+
+def test_repair_places_what_the_greedy_pass_could_not(school, check_timetable):
+    school()
+    main.ensure_timetable_table()
+    problem = prob.load_problem(connect.shared.cursor())
+    tt = engine.Timetable(problem.classes)
+    engine.assign_cca_periods(problem, tt)
+    missing = engine.place_all(problem, tt)
+    assert missing # Or there's nothing to repair
+
+    assert engine.repair(tt, missing) == []
+    engine.save(connect.shared, problem, tt)
+    check_timetable()
+
+def test_repair_swaps_the_periods_of_another_class():
+    # Class A is only free in slot 0, where teacher T has class B. T is only free in slot 1.
+    tt = engine.Timetable(["A", "B"])
+    for slot in range(1, prob.SLOTS):
+        tt.place("A", slot, f"S{slot}", None)
+    tt.place("B", 0, "MAT", "T")
+    tt.place("B", 1, "ENG", "V")
+    for slot in range(2, prob.SLOTS):
+        tt.place("B", slot, "MAT", "T")
+
+    assert engine.repair(tt, [("A", "MAT", "T")]) == []
+    assert tt.cells["A"][0] == ("MAT", "T")
+    assert tt.cells["B"][:2] == [("ENG", "V"), ("MAT", "T")]
+    assert tt.teacher_cells["T"][0] == "A" and tt.teacher_cells["T"][1] == "B"
+    assert tt.teacher_cells["V"] == {0: "B"}
+
+def test_repair_leaves_what_it_cannot_place():
+    # Teacher T is busy whenever class A is free
+    tt = engine.Timetable(["A", "B"])
+    for slot in range(1, prob.SLOTS):
+        tt.place("A", slot, f"S{slot}", None)
+    for slot in range(prob.SLOTS):
+        tt.place("B", slot, f"S{slot}", "T")
+    before = tt.copy_cells()
+
+    assert engine.repair(tt, [("A", "MAT", "T")]) == [("A", "MAT", "T")]
+    assert tt.copy_cells() == before
@@ -0,0 +1,84 @@
+# Saving the timetable in one transaction: a failed or cancelled run keeps the old one.
+# On a small made-up school in a SQLite database
+
+import pytest
+from utils import connect
+from utils import engine
+from utils import persist
+from utils import progress
+import main
+
+def _saved():
+    cursor = connect.shared.cursor()
+    cursor.execute("SELECT class, subject, teacher, period FROM timetable ORDER BY class, period, subject;")
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def test_failed_commit_rolls_back(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+    before = _saved()
+
+    # Class can't be NULL, which is found when the pending writes are sent, on commit
+    with pytest.raises(connect.Error):
+        with persist.TimetableWriter(connect.shared) as writer:
+            writer.clear()
+            writer.insert(None, "MAT", "T02", 1)
+    assert _saved() == before
+    check_timetable()
+
+def test_exception_rolls_back(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+    before = _saved()
+
+    with pytest.raises(RuntimeError):
+        with persist.TimetableWriter(connect.shared) as writer:
+            writer.clear()
+            writer.insert("9A", "MAT", "T02", 1)
+            writer.flush()
+            raise RuntimeError("Failed while saving")
+    assert _saved() == before
+    check_timetable()
+
+def test_failed_save_keeps_the_old_timetable(school, check_timetable, monkeypatch):
+    school()
+    main.generate_timetable("memory")
+    before = _saved()
+
+    # Small batches, so the old timetable is deleted and some new rows are written before it fails
+    class SmallBatches(persist.TimetableWriter):
+        def __init__(self, sql_conn):
+            super().__init__(sql_conn, batch_size = 10)
+    rows = engine.Timetable.rows
+    def failing_rows(tt, period_ids):
+        for i, row in enumerate(rows(tt, period_ids)):
+            if i == 100:
+                raise RuntimeError("Failed while saving")
+            yield row
+    monkeypatch.setattr(persist, "TimetableWriter", SmallBatches)
+    monkeypatch.setattr(engine.Timetable, "rows", failing_rows)
+
+    with pytest.raises(RuntimeError):
+        main.generate_timetable("memory")
+    assert _saved() == before
+    check_timetable()
+
+def test_cancelled_generate_keeps_the_old_timetable(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+    before = _saved()
+
+    def cancel(event, fields):
+        if event == "repairing":
+            progress.cancel()
+    progress.listen(cancel)
+    try:
+        with pytest.raises(progress.Cancelled):
+            main.generate_timetable("memory")
+    finally:
+        progress.listen(None)
+        progress.reset()
+    assert _saved() == before
+    check_timetable()
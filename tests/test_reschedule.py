@@ -0,0 +1,89 @@
+# Rescheduling after changes, on a small made-up school in a SQLite database.
+# Its maths teachers are T02 (9A, 10A) and T03 (9B, 10B), each class having 8 periods a week.
+
+import pytest
+from utils import connect
+from utils import engine
+from utils import reschedule
+import main
+
+# Everything reschedule() may change, to compare before and after
+def _saved():
+    cursor = connect.shared.cursor()
+    saved = []
+    for query in ("SELECT class, subject, teacher, period FROM timetable ORDER BY class, period, subject;",
+                  "SELECT class, subject, teacher FROM subject_teachers ORDER BY class, subject;",
+                  "SELECT grade, subject, per_week FROM periods_per_week ORDER BY grade, subject;"):
+        cursor.execute(query)
+        saved.append(cursor.fetchall())
+    cursor.close()
+    return saved
+
+def test_new_teacher_takes_over_the_periods(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+
+    changes, missing = reschedule.reschedule(connect.shared, replacements = [("9A", "MAT", "T03")])
+    assert missing == []
+    assert changes >= 8
+    tt = check_timetable()
+    assert [cell for cell in tt.cells["9A"] if cell and cell[0] == "MAT"] == [("MAT", "T03")] * 8
+
+def test_fewer_periods_a_week(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+
+    changes, missing = reschedule.reschedule(connect.shared, per_week = [(9, "MAT", 6)])
+    assert missing == []
+    tt = check_timetable()
+    assert tt.count("9A", "MAT") == tt.count("9B", "MAT") == 6
+    assert tt.count("10A", "MAT") == 8
+
+def test_teacher_leaving(school, check_timetable):
+    school()
+    main.generate_timetable("memory")
+
+    changes, missing = reschedule.reschedule(connect.shared, leaving = ["T02"])
+    assert missing == []
+    tt = check_timetable()
+    # Only CCA is left, as T02 is still 9A's class teacher
+    assert tt.teacher_cells["T02"] == {slot: "9A" for slot in engine.CCA_SLOTS}
+    assert tt.count("9A", "MAT") == tt.count("10A", "MAT") == 8
+
+def test_more_periods_than_fit_are_left_unplaced(school):
+    school()
+    main.generate_timetable("memory")
+
+    # The week is already full
+    changes, missing = reschedule.reschedule(connect.shared, per_week = [(9, "MAT", 9)])
+    assert sorted(missing) == [("9A", "MAT", "T02"), ("9B", "MAT", "T03")]
+
+@pytest.mark.parametrize("changes", [
+    {"replacements": [("9A", "MAT", "T99")]},
+    {"replacements": [("9Z", "MAT", "T03")]},
+    {"replacements": [("9A", "XYZ", "T03")]},
+    {"replacements": [("9A", "MAT", "T03"), ("9B", "MAT", "T99")]},
+    {"per_week": [(13, "MAT", 6)]},
+    {"per_week": [(9, "XYZ", 6)]},
+    {"leaving": ["T99"]},
+])
+def test_unknown_class_subject_grade_or_teacher_changes_nothing(school, changes):
+    school()
+    main.generate_timetable("memory")
+    before = _saved()
+
+    with pytest.raises(ValueError):
+        reschedule.reschedule(connect.shared, **changes)
+    assert _saved() == before
+
+def test_failure_changes_nothing(school, monkeypatch):
+    school()
+    main.generate_timetable("memory")
+    before = _saved()
+
+    def fail(tt, missing):
+        raise RuntimeError("Failed while repairing")
+    monkeypatch.setattr(engine, "repair", fail)
+    with pytest.raises(RuntimeError):
+        reschedule.reschedule(connect.shared, replacements = [("9A", "MAT", "T03")], per_week = [(10, "MAT", 6)])
+    assert _saved() == before
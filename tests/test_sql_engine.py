@@ -0,0 +1,37 @@
+# The SQL engine, run end to end on a small made-up school in a SQLite database
+
+import os
+from utils import classteachers
+from utils import connect
+from utils import db
+from utils import problem as prob
+from utils import sqlitedb
+from utils import synthetic
+import main
+
+def test_cca_on_saturday_first_two_periods(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(prob, "CACHE_DIR", None)
+    choices = synthetic.generate(str(tmp_path), range(9, 11), 2, electives = 0)
+    connect.set_connection(sqlitedb.connect(os.path.join(tmp_path, "timetable.db")))
+    try:
+        db.set_optional_subjects(choices, interactive = False)
+        db.update_db(str(tmp_path))
+        classteachers.assign_class_teachers("random")
+        main.generate_timetable("sql")
+
+        cursor = connect.shared.cursor()
+        cursor.execute("SELECT ID, teacher FROM classes;")
+        class_teachers = dict(cursor.fetchall())
+        cursor.execute("""
+            SELECT timetable.class, timetable.subject, timetable.teacher FROM timetable
+            JOIN periods ON periods.ID = timetable.period
+            WHERE periods.day = 'sat' AND periods.period IN (1, 2);
+        """)
+        cca = {}
+        for cls, subject, teacher in cursor.fetchall():
+            assert (subject, teacher) == ("CCA", class_teachers[cls])
+            cca[cls] = cca.get(cls, 0) + 1
+        assert cca == {cls: 2 for cls in class_teachers}
+    finally:
+        connect.close_connection()
@@ -1,60 +1,74 @@
-import random
+import heapq
 from utils import connect
 from utils import logmaster
+from utils import instrument
+from utils import problem as prob
 _log = logmaster.getLogger()
 
-# Connect to MySQL
-sql_conn = connect.connect_to_db()
-sql = sql_conn.cursor(dictionary=True)
+# The shared connection. Connects on first use.
+sql_conn = connect.shared
+sql = connect.LazyCursor(dictionary=True)
+
+# Most periods a week a teacher is given. A teacher can't take more than there are slots
+MAX_LOAD = prob.SLOTS
 
 # Assign subject teachers to each class.
-def assign_teachers():
-
-    # Assign teacher for a specific subject
-    #
-    # @param sub -- subject for which teacher is being assigned
-    def assign(sub):
-        # Get a list of eligible teachers.
-        eligible = [t for t in teachers if t["subject"] == sub]
-        if eligible:
-            # Sort the teachers based on load.
-            eligible.sort(key = lambda t: t["load"])
-            min_load = eligible[0]["load"]
-            # Get a list of least loaded teachers for fair overworking...
-            least_loaded = [t for t in eligible if t["load"] == min_load]
-            # Chose a random teacher from the least loaded ones...
-            chosen = random.choice(least_loaded)
-            chosen["load"] += 1
-            # Add the chosen teacher to the list of subject teachers.
-            sql.execute("UPDATE subject_teachers SET teacher = %s WHERE class = %s AND subject = %s;", [chosen["ID"], class_name, sub])
-            _log.debug(f"Assigned {chosen['ID']} to {class_name} for {sub}")     # For debugging purposes.
-        # Raise error if no eligible teacher found.
-        else:
-            _log.error(f"No eligible teacher found for {class_name} - {sub}")
-
-
-    # Get the list of teachers.
+#
+# Every subject has a heap of its teachers ordered by the periods a week they have so far,
+# then their serial number. Each class's subject goes to the top of the heap, who goes back
+# in with the periods added. The biggest subjects are handed out first, so the small ones
+# even out what is left. All of it is written in one go at the end.
+#
+# @param max_load -- Most periods a week per teacher. MAX_LOAD if None
+@instrument.timed
+def assign_teachers(max_load: int = None):
+    max_load = MAX_LOAD if max_load is None else max_load
+
+    # Get the teachers of each subject.
     sql.execute("SELECT ID, subject, serial FROM teachers;")
-    teachers = sql.fetchall()
-    for t in teachers:
-        t["load"] = 0
-    
-    # Get the list of subjects for each class.
-    sql.execute("SELECT * FROM subject_teachers;")
-    class_subjects = sql.fetchall()
-
-    # Shit gets real here...
-    for class_row in class_subjects:
-        # Get the class name and the list of subjects.
-        class_name = class_row["class"]
-        subject = class_row["subject"]
-
-        # Ignore the cases where the subject is empty...
-        if subject:
-            assign(subject)
-
-    # Close file and MySQL connection.
+    heaps = {}
+    for t in sql.fetchall():
+        heaps.setdefault(t["subject"], []).append((0, t["serial"], t["ID"]))
+    for heap in heaps.values():
+        heapq.heapify(heap)
+
+    # Get the subjects of each class, with its periods a week.
+    sql.execute("""
+        SELECT subject_teachers.class, subject_teachers.subject, periods_per_week.per_week
+        FROM subject_teachers
+        JOIN classes ON classes.ID = subject_teachers.class
+        LEFT JOIN periods_per_week ON periods_per_week.grade = classes.grade AND periods_per_week.subject = subject_teachers.subject;
+    """)
+    class_subjects = [row for row in sql.fetchall() if row["subject"]] # Ignore the cases where the subject is empty...
+    class_subjects.sort(key = lambda row: row["per_week"] or 0, reverse = True)
+
+    # (teacher, class, subject) to save. None for the teacher where nobody could be given,
+    # so no one is left with a subject from before
+    assigned = []
+    for row in class_subjects:
+        class_name, subject, periods = row["class"], row["subject"], row["per_week"] or 0
+        heap = heaps.get(subject)
+        if not heap:
+            _log.error("No eligible teacher found for %s - %s", class_name, subject)
+            assigned.append((None, class_name, subject))
+            continue
+        # The least loaded teacher is the only one who might have room
+        load, serial, teacher = heap[0]
+        if load + periods > max_load:
+            _log.error("No teacher of %s has %s periods a week free for %s.", subject, periods, class_name)
+            assigned.append((None, class_name, subject))
+            continue
+        heapq.heapreplace(heap, (load + periods, serial, teacher))
+        assigned.append((teacher, class_name, subject))
+        _log.debug("Assigned %s to %s for %s", teacher, class_name, subject)     # For debugging purposes.
+
+    # Save the assignments.
+    sql.executemany("UPDATE subject_teachers SET teacher = %s WHERE class = %s AND subject = %s;", assigned)
+    prob.inputs_changed(sql)
     sql_conn.commit()
-    sql_conn.close()
-    
-    _log.info("Teacher assignment completed.")
+
+    for subject, heap in heaps.items():
+        if heap:
+            _log.debug("%s: %s to %s periods a week per teacher.", subject, min(heap)[0], max(heap)[0])
+    done = sum(teacher is not None for teacher, _, _ in assigned)
+    _log.info("Teacher assignment completed: %s of %s subjects of classes assigned.", done, len(class_subjects))
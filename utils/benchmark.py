@@ -0,0 +1,104 @@
+# Times the whole pipeline on made up schools of several sizes, so slowdowns show up.
+#
+# For each size, a school is made up with synthetic.py in its own directory and loaded
+# into a fresh SQLite database there, which is made the shared connection while the
+# benchmark runs. Every phase -- loading the CSV files, assigning teachers, making the
+# timetable, repairing it, exporting it -- is timed, and the SQL statements it sends are
+# counted. The unassigned periods each engine leaves are measured with metrics.py.
+
+import os
+import time
+from utils import logmaster
+from utils import connect
+from utils import instrument
+from utils import sqlitedb
+from utils import db
+from utils import assignteachers
+from utils import classteachers
+from utils import prettyprint
+from utils import engine
+from utils import metrics
+from utils import synthetic
+from utils import problem as prob
+
+_log = logmaster.getLogger()
+
+# Unassigned periods of the saved timetable
+def _unassigned():
+    cursor = connect.shared.cursor(buffered=True)
+    problem = prob.load_problem(cursor)
+    return metrics.measure(problem, engine.load_timetable(cursor, problem))["unassigned"]
+
+# Runs the benchmark
+#
+# Returns a list with a dictionary for each size:
+#   {"sections", "classes", "teachers",
+#    "phases": {phase: {"seconds", "queries"}},
+#    "unassigned": {"sql", "greedy", "memory"}}
+#
+# @param sections     -- List of sizes, as the number of sections in each grade
+# @param generate     -- generate_timetable() of main.py
+# @param work_dir     -- Where to put the CSV files and databases
+# @param grades       -- The grades. Eg: range(6, 13)
+# @param teacher_load -- See synthetic.generate()
+# @param electives    -- See synthetic.generate()
+# @param sql          -- Whether to time the original SQL engine as well. It is slow on big schools.
+# @param campuses     -- See synthetic.generate()
+def run(sections: list, generate, work_dir: str = "benchmark", grades = range(6, 13), teacher_load: int = 30, electives: float = 0.5, sql: bool = True, campuses: int = 1):
+    results = []
+    for size in sections:
+        size_dir = os.path.join(work_dir, f"{size}-sections")
+        choices = synthetic.generate(size_dir, grades, size, teacher_load, electives, campuses = campuses)
+        db_path = os.path.join(size_dir, "timetable.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        connect.set_connection(sqlitedb.connect(db_path))
+        db.set_optional_subjects(choices, interactive = False)
+
+        result = {"sections": size, "phases": {}, "unassigned": {}}
+
+        # Times a phase and counts its statements
+        def phase(name: str, function, *args):
+            _log.info("Benchmark: %s sections, %s...", size, name)
+            queries = instrument.totals()["statements"]
+            start = time.perf_counter()
+            value = function(*args)
+            result["phases"][name] = {"seconds": round(time.perf_counter() - start, 4), "queries": instrument.totals()["statements"] - queries}
+            return value
+
+        phase("update_db", db.update_db, size_dir)
+        phase("assign_teachers", assignteachers.assign_teachers)
+        phase("assign_class_teachers", classteachers.assign_class_teachers, "random")
+
+        if sql:
+            phase("create_timetable (sql)", generate, "sql")
+            result["unassigned"]["sql"] = _unassigned()
+        phase("create_timetable (memory)", generate, "memory")
+        result["unassigned"]["memory"] = _unassigned()
+
+        # The repair stage alone, on a greedy timetable made again in memory
+        problem = prob.load_problem(connect.shared.cursor(buffered=True))
+        tt = engine.Timetable(problem.classes)
+        engine.assign_cca_periods(problem, tt)
+        missing = engine.place_all(problem, tt)
+        result["unassigned"]["greedy"] = len(missing)
+        phase("repair", engine.repair, tt, missing)
+
+        phase("export", prettyprint.export, os.path.join(size_dir, "ctt.csv"), os.path.join(size_dir, "ttt.csv"), os.path.join(size_dir, "timetable.snap"))
+
+        result["classes"] = len(problem.classes)
+        result["teachers"] = len(problem.teacher_subject)
+        results.append(result)
+        connect.close_connection()
+
+    return results
+
+# Lays the results of run() out as a table, one line per phase of each size
+def report(results: list):
+    lines = [f"{'classes':>8} {'teachers':>8}  {'phase':<26}{'seconds':>9}{'queries':>9}"]
+    for result in results:
+        for name, numbers in result["phases"].items():
+            lines.append(f"{result['classes']:>8} {result['teachers']:>8}  {name:<26}{numbers['seconds']:>9.3f}{numbers['queries']:>9}")
+        unassigned = ", ".join(f"{engine_name} {count}" for engine_name, count in result["unassigned"].items())
+        lines.append(f"{result['classes']:>8} {result['teachers']:>8}  unassigned periods: {unassigned}")
+    return "\n".join(lines)
@@ -2,18 +2,25 @@ import csv
 import random
 from utils import connect
 from utils import logmaster
+from utils import instrument
+from utils import problem as prob
 
 _log = logmaster.getLogger()
 
-# Connect to MySQL
-conn = connect.connect_to_db()
-sql = conn.cursor()
+# The shared connection. Connects on first use.
+conn = connect.shared
+sql = connect.LazyCursor()
 
 # Assign co class teachers based on class teacher data.
 def assign_co_ct():
-    sql.execute("SELECT ID, teacher FROM classes;")
-    ct_data = sql.fetchall()
     _log.info("Fetching data from table classes...")
+    sql.execute("SELECT ID, campus, grade, teacher FROM classes ORDER BY campus, grade, section;")
+    ct_data = sql.fetchall()
+
+    # The classes of each grade of each campus, in the order of sections
+    grades = {}
+    for cls, campus, grade, teacher in ct_data:
+        grades.setdefault((campus, grade), []).append((cls, teacher))
 
     # Dictionary to store the co class teachers along with the class.
     # 
@@ -22,20 +29,13 @@ def assign_co_ct():
     co_ct = {}
 
     _log.debug("Assigning co class teachers...")
-    for cls in ct_data:
-        section = cls[0][-1].upper()
-        grade = cls[0][:-1]
-
-        # Obtain the section for which that section's class teacher will be the co class teacher.
-        co_section = ""
-        if section == "A":
-            co_section = "E"
-        else:
-            co_section = chr(ord(section) - 1)
-
-        # Save to dictionary co_ct.
-        teacher = cls[1]
-        co_ct[grade + co_section] = teacher
+    for classes in grades.values():
+        # A section's co class teacher is the next section's class teacher. The last section's is the first's.
+        # A grade with a single section has nobody to share with.
+        if len(classes) < 2:
+            continue
+        for i, (cls, _) in enumerate(classes):
+            co_ct[cls] = classes[(i + 1) % len(classes)][1]
 
     # Update the classes table in MySQL.
     _log.info("Updating co class teachers in table classes...")
@@ -69,8 +69,7 @@ def promote_class_teachers():
     updated_data = []
 
     for cls, teacher, co_teacher in data:
-        grade = int(cls[:-1])
-        section = cls[-1].upper()
+        campus, grade, section = prob.parse_class(cls)
         new_grade = None
         
         # Apply promotion rules...
@@ -84,7 +83,7 @@ def promote_class_teachers():
             new_grade = grade + 1
         
         # Append the updated data to a new list.
-        new_class = f"{new_grade}{section}"
+        new_class = f"{campus}{new_grade}{section}"
         updated_data.append((new_class, teacher, co_teacher))
     
     try:
@@ -126,14 +125,14 @@ def random_assign_ct(not_ct:list = ['GF', 'KK', 'NI', 'RJ', 'AT', 'RC', 'DKS', '
             available_teachers = [i[0] for i in subject_teachers if i[0] not in CTs and i[0] not in not_ct]
 
             if not available_teachers:
-                _log.error(f"No eligible teachers found for class {clss}.")
+                _log.error("No eligible teachers found for class %s.", clss)
             
             else:
 
                 # Randomly select a teacher from the available ones and append to the list.
                 ct = random.choice(available_teachers)
                 class_teachers.append([clss, ct])
-                _log.debug(f"Assigned {ct} as class teacher for class {clss}.")
+                _log.debug("Assigned %s as class teacher for class %s.", ct, clss)
 
                 # Update the classes table in MySQL.
                 sql.execute("UPDATE classes SET teacher = %s WHERE ID = %s;", [ct, clss])
@@ -152,34 +151,50 @@ def random_assign_ct(not_ct:list = ['GF', 'KK', 'NI', 'RJ', 'AT', 'RC', 'DKS', '
         _log.error(f"Error while randomly assigning class teachers: {e}")
         return False
 
-# Prompt user for class teacher assignment method
-def class_teacher_prompt():
-    # Prompt: Assign class teachers from file?
-    if input("Do you want to assign class teachers from a CSV file? [Y/n] ") in "Yy":
-        assign_ct(input("Enter the path to the CSV file: "))
-        print("Class teachers assigned from file.")
-
-    # Prompt: Promote class teachers from last year?
-    elif input("Do you want to promote class teachers from last year? [Y/n] ") in "Yy":
+# Assign class teachers without asking anything, then the co class teachers.
+#
+# @param method    -- "file" to read them from a CSV file, "promote" to promote last year's,
+#                     "random" to pick them randomly
+# @param file_path -- path to the CSV file if method is "file"
+@instrument.timed
+def assign_class_teachers(method: str, file_path: str = None):
+    if method == "file":
+        assign_ct(file_path)
+        _log.info("Class teachers assigned from file %s.", file_path)
+
+    elif method == "promote":
         try:
             promote_class_teachers()
-            print("Class teachers promoted from last year.")
         except:
-            _log.error("Error promoting class teachers from last year.")
-            print("Error promoting class teachers from last year.")
-            print("Assigning class teachers randomly...")
-            random_assign_ct()
-    else:
-        print("Randomly assigning class teachers...")
+            _log.error("Error promoting class teachers from last year. Assigning class teachers randomly...")
+            method = "random"
+
+    if method == "random":
         for i in range(3):  # Try thrice to assign class teachers
             if random_assign_ct():
                 break
-            else:
-                random_assign_ct()
         else:
             _log.error("Error assigning class teachers after 3 attempts.")
-            print("Error assigning class teachers.")
+
     try:
         assign_co_ct()
     except:
-        pass
+        _log.error("Error assigning co class teachers.")
+
+    prob.inputs_changed(sql)
+    conn.commit()
+
+# Prompt user for class teacher assignment method
+def class_teacher_prompt():
+    # Prompt: Assign class teachers from file?
+    if input("Do you want to assign class teachers from a CSV file? [Y/n] ") in "Yy":
+        assign_class_teachers("file", input("Enter the path to the CSV file: "))
+        print("Class teachers assigned from file.")
+
+    # Prompt: Promote class teachers from last year?
+    elif input("Do you want to promote class teachers from last year? [Y/n] ") in "Yy":
+        assign_class_teachers("promote")
+        print("Class teachers promoted from last year.")
+    else:
+        print("Randomly assigning class teachers...")
+        assign_class_teachers("random")
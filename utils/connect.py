@@ -1,10 +1,24 @@
 import json
-import mysql.connector
 from utils import logmaster
+from utils import sqlitedb
+from utils import instrument
+
+# MySQL is only needed if it is the backend in use
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
 
 _log = logmaster.getLogger()
 
+# Database errors of whichever backend is in use. Catch these instead of mysql.connector.Error
+Error = (sqlitedb.Error, mysql.connector.Error) if mysql else (sqlitedb.Error,)
+
 # Try to connect to the database
+#
+# The backend is chosen by the key "backend" in `.json`, "mysql" if it isn't there.
+# For "mysql", the keys "host", "user", "passwd" and "database" are needed.
+# For "sqlite", the key "path" -- the database file or ":memory:".
 def connect_to_db():
     # Open password file
     _log.info("Reading database access credentials...")
@@ -15,7 +29,18 @@ def connect_to_db():
     except:
         _log.error("Couldn't read database access credentials. Terminating.")
         exit(-1)
-    
+
+    backend = sql_cred.get("backend", "mysql")
+    if backend == "sqlite":
+        return _connect_to_sqlite(sql_cred.get("path", "timetable.db"))
+    elif backend != "mysql":
+        _log.error("Unknown database backend '%s'. Terminating.", backend)
+        exit(-1)
+
+    if mysql is None:
+        _log.error("mysql-connector-python is not installed. Terminating.")
+        exit(-1)
+
     # Attempting to connect
     try:
         _log.info("Establishing connection to databse...")
@@ -29,3 +54,73 @@ def connect_to_db():
     except mysql.connector.Error as err: # failed to connect
         _log.error(err)
         exit(-1)
+
+# Opens the embedded SQLite database
+#
+# @param path -- Path to the database file or ":memory:"
+def _connect_to_sqlite(path: str):
+    try:
+        _log.info("Opening SQLite database %s...", path)
+        sql_conn = sqlitedb.connect(path)
+        _log.info("Connected to database.")
+        return sql_conn
+    except sqlitedb.Error as err:
+        _log.error(err)
+        exit(-1)
+
+# ----------- SHARED CONNECTION -----------
+#
+# The whole program uses a single connection, opened the first time it is needed.
+# Modules keep `connect.shared` and `connect.LazyCursor()` in their globals, so
+# importing them doesn't connect to anything.
+
+_shared_conn = None
+
+# Returns the connection shared by the whole program. Connects the first time it is asked for.
+# Its cursors count what they do; see instrument.py
+def get_connection():
+    global _shared_conn
+    if _shared_conn is None:
+        _shared_conn = instrument.wrap(connect_to_db())
+    return _shared_conn
+
+# Closes the shared connection. The next get_connection() connects again.
+def close_connection():
+    global _shared_conn
+    if _shared_conn is not None:
+        _shared_conn.close()
+        _shared_conn = None
+        _log.info("Closed connection to database.")
+
+# Makes another connection the shared one, closing the one open. Eg: a scratch database for benchmarks
+def set_connection(conn):
+    global _shared_conn
+    close_connection()
+    _shared_conn = instrument.wrap(conn)
+
+# Stands in for the shared connection. Eg: connect.shared.commit()
+class _SharedConnection:
+    def __getattr__(self, name):
+        return getattr(get_connection(), name)
+
+shared = _SharedConnection()
+
+# A cursor on the shared connection that is only opened when first used
+#
+# @param kwargs -- Passed on to cursor(). Eg: buffered=True, dictionary=True
+class LazyCursor:
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._conn = None
+        self._cursor = None
+
+    def __getattr__(self, name):
+        conn = get_connection()
+        if self._conn is not conn: # First use, or the connection was reopened since
+            self._conn = conn
+            self._cursor = conn.cursor(**self._kwargs)
+        return getattr(self._cursor, name)
+
+    # The rows of the last query, one at a time, without fetching them all first
+    def __iter__(self):
+        return iter(self._cursor)
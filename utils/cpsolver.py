@@ -0,0 +1,128 @@
+# A constraint programming backend for timetable generation, using Google OR-Tools' CP-SAT.
+#
+# Instead of placing periods one by one and patching things up afterwards, the
+# whole timetable is described as a set of rules and the solver either finds a
+# timetable that follows all of them or proves that none exists. The rules:
+#   - Every class-subject combination gets exactly its periods per week
+#   - A class has at most one period at a time
+#   - A teacher has at most one period at a time
+#   - CCA is on the first two periods of saturday, with the class teacher
+#   - Block subjects have at most 2 periods a day, and if 2, they are consecutive
+# And, as far as they can be without breaking those, which is what is optimized:
+#   - Other subjects are spread out: periods beyond ceil(periods per week / 6) a day
+#     count as bunching, weighted as in score.py
+#   - The first period of the day goes to the class teacher
+#
+# OR-Tools is optional. Install it with `pip install ortools` to use this.
+
+from utils import logmaster
+from utils import score
+from utils import engine
+from utils import problem as prob
+from utils import instrument
+
+try:
+    from ortools.sat.python import cp_model
+except ImportError:
+    cp_model = None
+
+_log = logmaster.getLogger()
+
+# Whether OR-Tools is installed
+def available():
+    return cp_model is not None
+
+# Makes a timetable that satisfies every rule
+#
+# Returns the engine.Timetable. Raises ValueError saying why if OR-Tools isn't installed,
+# there is no such timetable, or none was found within the time limit
+#
+# @param time_limit -- Maximum number of seconds to search for
+# @param workers    -- Number of search workers. CP-SAT runs a different strategy in each,
+#                      which pays off even with fewer cores than workers
+@instrument.timed
+def solve(problem: prob.Problem, time_limit: float = 60.0, workers: int = 8):
+    if not available():
+        raise ValueError("OR-Tools is not installed. Run `pip install ortools` to use the CP solver.")
+
+    tt = engine.Timetable(problem.classes)
+    engine.assign_cca_periods(problem, tt)
+
+    model = cp_model.CpModel()
+    x = {} # (index of requirement, slot) -> BoolVar
+    class_slots = {cls: [[] for _ in range(prob.SLOTS)] for cls in problem.classes}
+    teacher_slots = {}
+    first_periods = [] # BoolVars of class teachers in first periods
+    bunching = []      # IntVars of periods of a subject beyond its daily limit
+    limits = score.daily_limits(problem)
+
+    for r, req in enumerate(problem.requirements):
+        remaining = req.per_week - tt.count(req.class_name, req.subject)
+        if remaining <= 0:
+            continue
+
+        slots = [slot for slot in range(prob.SLOTS) if tt.is_free(req.class_name, req.teacher, 1 << slot)]
+        for slot in slots:
+            x[r, slot] = model.new_bool_var(f"{req.class_name}_{req.subject}_{slot}")
+            class_slots[req.class_name][slot].append(x[r, slot])
+            if req.teacher is not None:
+                for teacher in prob.members(req.teacher): # Each teacher of an elective group
+                    teacher_slots.setdefault(teacher, [[] for _ in range(prob.SLOTS)])[slot].append(x[r, slot])
+            if req.is_class_teacher and slot % prob.PERIODS_PER_DAY == 0:
+                first_periods.append(x[r, slot])
+
+        model.add(sum(x[r, slot] for slot in slots) == remaining)
+
+        for day in range(len(prob.DAYS)):
+            day_vars = [x[r, slot] for slot in range(day * prob.PERIODS_PER_DAY, (day + 1) * prob.PERIODS_PER_DAY) if (r, slot) in x]
+            if req.intensity == "block":
+                model.add(sum(day_vars) <= 2)
+                # No two periods on the same day unless they are next to each other
+                day_slots = [slot for slot in range(day * prob.PERIODS_PER_DAY, (day + 1) * prob.PERIODS_PER_DAY) if (r, slot) in x]
+                for i, a in enumerate(day_slots):
+                    for b in day_slots[i + 1:]:
+                        if b - a > 1:
+                            model.add_bool_or([x[r, a].negated(), x[r, b].negated()])
+            elif len(day_vars) > limits[req.class_name][req.subject]:
+                excess = model.new_int_var(0, len(day_vars), f"{req.class_name}_{req.subject}_{day}_excess")
+                model.add(excess >= sum(day_vars) - limits[req.class_name][req.subject])
+                bunching.append(excess)
+
+    # If a class has exactly as many periods to place as it has free slots, every free
+    # slot must be filled. Saying so outright helps the solver a lot.
+    for cls, row in class_slots.items():
+        needed = sum(max(req.per_week - tt.count(cls, req.subject), 0) for req in problem.requirements if req.class_name == cls)
+        full = needed == len(tt.free_slots(cls))
+        for slot_vars in row:
+            if full and slot_vars:
+                model.add_exactly_one(slot_vars)
+            elif len(slot_vars) > 1:
+                model.add_at_most_one(slot_vars)
+
+    for row in teacher_slots.values():
+        for slot_vars in row:
+            if len(slot_vars) > 1:
+                model.add_at_most_one(slot_vars)
+
+    model.maximize(sum(first_periods) - score.WEIGHTS["bunching"] * sum(bunching))
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = workers
+    _log.info("Solving with CP-SAT: %s variables, time limit %ss...", len(x), time_limit)
+    status = solver.solve(model)
+
+    if status == cp_model.INFEASIBLE:
+        raise ValueError("CP-SAT proved that no timetable satisfies every rule.")
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        raise ValueError(f"CP-SAT found no timetable within {time_limit}s.")
+
+    for (r, slot), var in x.items():
+        if solver.value(var):
+            req = problem.requirements[r]
+            tt.place(req.class_name, slot, req.subject, req.teacher)
+
+    _log.info("CP-SAT found %s timetable in %.2fs. %s first periods with the class teacher, %s periods bunched.",
+              "an optimal" if status == cp_model.OPTIMAL else "a complete", solver.wall_time,
+              sum(solver.value(var) for var in first_periods), sum(solver.value(var) for var in bunching))
+    return tt
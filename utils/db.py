@@ -10,10 +10,13 @@
 # 'period' refers to a specific interval of time in the time table.
 
 import csv
-import mysql.connector
+import os
 from utils import logmaster
 from utils import assignteachers
 from utils import connect
+from utils import instrument
+from utils import progress
+from utils import problem as prob
 
 def _initialise_db():
     # Save last year's class teachers into a table
@@ -34,6 +37,7 @@ def _initialise_db():
     _sql.execute("DROP TABLE IF EXISTS teachers;")
     _sql.execute("DROP TABLE IF EXISTS subjects;")
     _sql.execute("DROP TABLE IF EXISTS periods;")
+    _sql.execute("DROP TABLE IF EXISTS problem_inputs;")
     _log.debug("Dropped all previous tables from database.")
 
     # Create table `subjects`
@@ -82,36 +86,46 @@ def _initialise_db():
     """)
 
     # Create table `classes`
-    # @field ID         -- 6A, 7B etc...
+    # @field ID         -- 6A, 7B, N10C etc... See problem.parse_class()
+    # @field campus     -- Campus of the class, "" for schools having just the one
+    # @field grade      -- The grade
+    # @field section    -- The section
     # @field teacher    -- The class teacher
     # @field co_teacher -- The co-class teacher
     _sql.execute("""
         CREATE TABLE classes (
-            ID         VARCHAR(3) NOT NULL PRIMARY KEY,
+            ID         VARCHAR(8) NOT NULL PRIMARY KEY,
+            campus     VARCHAR(4) NOT NULL,
+            grade      TINYINT    NOT NULL,
+            section    VARCHAR(4) NOT NULL,
             teacher    VARCHAR(3) UNIQUE,
             co_teacher VARCHAR(3) UNIQUE,
             FOREIGN KEY (teacher) REFERENCES teachers(ID) ON UPDATE CASCADE ON DELETE RESTRICT,
             FOREIGN KEY (co_teacher) REFERENCES teachers(ID) ON UPDATE CASCADE ON DELETE RESTRICT
         ) Engine = InnoDB;
     """)
+    _sql.execute("CREATE INDEX classes_grade ON classes (campus, grade, section);")
     _log.debug("Created table classes.")
 
     # Create table `subject_teachers`
     # @field class        -- 6A, 7B etc...
     # @field subject      -- subject
-    # @field teacher      -- the teacher who teaches `subject` for this class
-    # @field pair_subject -- The other optional subject that may/may not exist
-    #                        This subject will also have another record where it is the `subject`
-    #                        and the teacher for this subject for the same class can be found in that record...
+    # @field teacher        -- the teacher who teaches `subject` for this class
+    # @field elective_group -- The optional subjects this one is taught at the same time as, if the class
+    #                          takes all of them. Eg: "SAN/FRE". Every subject of the group has a record
+    #                          with the same `elective_group`. See problem.py
     _sql.execute("""
         CREATE TABLE subject_teachers (
-            class        VARCHAR(3) NOT NULL,
-            subject      VARCHAR(4) NOT NULL,
-            teacher      VARCHAR(3) DEFAULT NULL,
+            class          VARCHAR(8)  NOT NULL,
+            subject        VARCHAR(4)  NOT NULL,
+            teacher        VARCHAR(3)  DEFAULT NULL,
+            elective_group VARCHAR(24) DEFAULT NULL,
             FOREIGN KEY (subject) REFERENCES subjects(ID) ON UPDATE CASCADE ON DELETE RESTRICT,
             FOREIGN KEY (teacher) REFERENCES teachers(ID) ON UPDATE CASCADE ON DELETE RESTRICT
         ) Engine = InnoDB;
     """)
+    # Teachers are assigned, and replaced, a class and subject at a time
+    _sql.execute("CREATE INDEX subject_teachers_class ON subject_teachers (class, subject);")
     _log.debug("Created table subject_teachers.")
     
     # Create table `periods_per_week`
@@ -126,12 +140,64 @@ def _initialise_db():
             FOREIGN KEY (subject) REFERENCES subjects(ID) ON UPDATE CASCADE ON DELETE RESTRICT
         ) Engine = InnoDB;
     """)
+    _sql.execute("CREATE INDEX periods_per_week_grade ON periods_per_week (grade, subject);")
     _log.debug("Created table periods_per_week.")
 
+    # Create table `problem_inputs`
+    # @field token -- A random token, replaced whenever the tables above change. See problem.inputs_changed()
+    _sql.execute("CREATE TABLE problem_inputs (token CHAR(32) NOT NULL) Engine = InnoDB;")
+    _log.debug("Created table problem_inputs.")
+
 
     _log.info("Preparing to load data...")
     _sql_conn.commit()
 
+# Rows are sent to the database this many at a time
+BATCH_SIZE = 1000
+
+# Rows loaded and rejected for each table by the last update_db(). table -> {"loaded", "rejected"}
+load_report = {}
+
+# Inserts rows into a table in batches of BATCH_SIZE, one executemany() each.
+# If a batch fails (Eg: a foreign key doesn't match), it is undone and its rows are
+# inserted one by one, so only the bad rows are left out.
+#
+# @param table  -- table into which the rows are to be inserted
+# @param rows   -- iterable of (line number, row) pairs. The line number is for error messages
+# @param width  -- number of values in a row
+# @param ignore -- Use INSERT IGNORE, for rows that may be there already
+def _insert_rows(table: str, rows, width: int, ignore: bool = False):
+    query = f"INSERT {'IGNORE ' if ignore else ''}INTO {table} VALUES ({', '.join(['%s'] * width)});"
+    report = load_report.setdefault(table, {"loaded": 0, "rejected": 0})
+
+    def insert(batch):
+        _sql.execute("SAVEPOINT batch;")
+        try:
+            _sql.executemany(query, [row for _, row in batch])
+            _sql.execute("RELEASE SAVEPOINT batch;")
+            report["loaded"] += len(batch)
+            return
+        except connect.Error:
+            _sql.execute("ROLLBACK TO SAVEPOINT batch;")
+            _sql.execute("RELEASE SAVEPOINT batch;")
+
+        for line, row in batch:
+            try:
+                _sql.execute(query, row)
+                report["loaded"] += 1
+            except connect.Error as err:
+                report["rejected"] += 1
+                _log.warning("Rejected line %s for table %s %s: %s", line, table, row, err)
+
+    batch = []
+    for line, row in rows:
+        batch.append((line, row))
+        if len(batch) == BATCH_SIZE:
+            insert(batch)
+            batch = []
+    if batch:
+        insert(batch)
+
 # Loads data from a CSV file into a table
 # It is assumed that a header is present in the CSV file
 #
@@ -140,39 +206,85 @@ def _initialise_db():
 def load_records_from_file(file_path: str, table: str):
     _log.debug("Loading data from file %s to table %s...", file_path, table)
     try:
-        file = open(file_path)
-        reader = csv.reader(file)
-    
-        # Ignore the header
-        next(reader)
+        with open(file_path, newline="") as file:
+            reader = csv.reader(file)
+            width = len(next(reader)) # The header
+            report = load_report.setdefault(table, {"loaded": 0, "rejected": 0})
 
-        for row in reader:
-            for i in range(len(row)):
-                if row[i] == "" or row[i] == "NULL":
-                    row[i] = None
+            # Rows with the wrong number of values are left out here, the rest by the database
+            def rows():
+                for line, row in enumerate(reader, start = 2):
+                    if not row:
+                        continue
+                    if len(row) != width:
+                        report["rejected"] += 1
+                        _log.warning("Rejected line %s of %s: expected %s values, found %s.", line, file_path, width, len(row))
+                        continue
+                    yield line, [None if value == "" or value == "NULL" else value for value in row]
 
-            # Creates a string having as many `%s` as there are values in the list `row`
-            _log.debug("INSERT INTO %s VALUES %s;", table, str(row))
-            _sql.execute("INSERT INTO " + table + " VALUES (" + ', '.join(['%s'] * len(row)) + ");", row)
-
-        file.close()
+            _insert_rows(table, rows(), width)
 
         _log.info("Successfully loaded data from file %s.", file_path)
-    except mysql.connector.Error as err:
+    except connect.Error as err:
         _log.warning(err)
 
+# Answers to the choice between optional subjects, so nobody has to be asked.
+# See set_optional_subjects()
+_optional_subjects = {}
+_interactive = True
+
+# Pre-answers the choice between optional subjects (Eg: "HIN/SAN" in subjectdata.csv)
+#
+# @param choices     -- Dictionary of class -> {options: chosen subject}. Class "*" applies to every class
+#                       Eg: {"*": {"HIN/SAN": "HIN"}, "9A": {"HIN/SAN": "SAN"}}
+# @param interactive -- Whether to ask when there's no answer. If not, it's an error.
+def set_optional_subjects(choices: dict, interactive: bool = True):
+    global _optional_subjects, _interactive
+    _optional_subjects = choices
+    _interactive = interactive
+
+# Chooses one of the optional subjects for a class, from the answers given beforehand or else by asking.
+# The class may also take all of them, as an elective group: the answer is then the options themselves
+# (Eg: "HIN/SAN"), and so it is when there's no answer and nobody to ask.
+#
+# Returns the subject chosen, or None for all of them
+#
+# @param class_name -- 6A, 7B etc...
+# @param subject    -- The options as in the CSV file. Eg: "HIN/SAN"
+def _choose_optional_subject(class_name: str, subject: str):
+    sub_options = subject.split('/') # We'll have two sub_IDs separated
+
+    for key in (class_name, "*"):
+        chosen = _optional_subjects.get(key, {}).get(subject)
+        if chosen is None:
+            continue
+        if chosen == subject:
+            _log.debug("Chose all of %s for class %s.", subject, class_name)
+            return None
+        if chosen not in sub_options:
+            _log.error("'%s' is not one of the optional subjects %s for class %s. Terminating.", chosen, subject, class_name)
+            exit(-1)
+        _log.debug("Chose %s out of %s for class %s.", chosen, subject, class_name)
+        return chosen
+
+    if not _interactive:
+        _log.info("No choice given between optional subjects %s for class %s. Taking all of them as an elective group.", subject, class_name)
+        return None
+    return _clarify_optional_subject(class_name, sub_options, [str(i) for i in range(1, len(sub_options) + 2)])
+
 def _clarify_optional_subject(class_name: str, subject_options: list, valid_responses: list):
     print(f"Regarding optional subjects for class {class_name},")
     for i in range(len(subject_options)):
         _sql.execute("SELECT name FROM subjects WHERE ID = %s;", [subject_options[i]])
         print(f"[{i + 1}] {_sql.fetchall()[0][0]}")
+    print(f"[{len(subject_options) + 1}] All of them, at the same time (elective group)")
 
     while True:
         choice = input(f"choose the suitable subject [{'/'.join([i for i in valid_responses])}]: ")
 
         if choice in valid_responses:
             print()
-            return subject_options[int(choice) - 1]
+            return subject_options[int(choice) - 1] if int(choice) <= len(subject_options) else None
         else:
             print(f"Invalid input! You have to choose one among [{'/'.join([i for i in valid_responses])}]")
 
@@ -194,57 +306,91 @@ def _clarify_optional_subject(class_name: str, subject_options: list, valid_resp
 def _load_subject_data(file_path: str, table: str):
     _log.debug("Loading data from file %s to table %s...", file_path, table)
     try:
-        file = open(file_path)
-        reader = csv.reader(file)
+        with open(file_path, newline="") as file:
+            reader = csv.reader(file)
 
-        # Ignore the header
-        next(reader)
+            # Ignore the header
+            next(reader)
 
-        for row in reader:
-            _sql.execute("INSERT IGNORE INTO classes VALUES (%s, %s, %s)", [row[0], None, None])
-            for subject in row[1::]: # Everything *after* the first value is a subject. Loop through each one
-                if '/' in subject:   # For optional subjects...
-                    sub_options = subject.split('/') # We'll have two sub_IDs separated
-                    subject = _clarify_optional_subject(row[0], sub_options, [str(i) for i in range(1, len(sub_options) + 1)])
+            classes = []
+            subjects = []
+            for line, row in enumerate(reader, start = 2):
+                if not row:
+                    continue
+                try:
+                    campus, grade, section = prob.parse_class(row[0])
+                except ValueError as err:
+                    load_report.setdefault(table, {"loaded": 0, "rejected": 0})["rejected"] += 1
+                    _log.warning("Rejected line %s of %s: %s", line, file_path, err)
+                    continue
+                classes.append((line, [row[0], campus, grade, section, None, None]))
+                for subject in row[1::]: # Everything *after* the first value is a subject. Loop through each one
+                    if '/' in subject:   # For optional subjects...
+                        chosen = _choose_optional_subject(row[0], subject)
+                        if chosen is None: # All of them, taught at the same time
+                            subjects += [(line, [row[0], option, None, subject]) for option in subject.split('/')]
+                            continue
+                        subject = chosen
 
-                if subject != "":
-                    _log.debug("INSERT INTO %s VALUES %s;", table, str([row[0], subject, None]))
-                    _sql.execute("INSERT INTO " + table + " VALUES (" + ', '.join(['%s'] * 3) + ");", [row[0], subject, None])
+                    if subject != "":
+                        subjects.append((line, [row[0], subject, None, None]))
+
+                # Send them off every now and then instead of holding the whole file
+                if len(subjects) >= BATCH_SIZE:
+                    _insert_rows("classes", classes, 6, ignore = True)
+                    _insert_rows(table, subjects, 4)
+                    classes, subjects = [], []
+
+            _insert_rows("classes", classes, 6, ignore = True)
+            _insert_rows(table, subjects, 4)
 
-        file.close()
         _log.info("Successfully loaded data from file %s.", file_path)
-    except mysql.connector.Error as err:
+    except connect.Error as err:
         _log.warning(err)
 
 # Insert into table `periods` all possible periods
 def _add_periods(table: str):
-    for i in ["mon", "tue", "wed", "thu", "fri", "sat"]:
-        for j in range(1, 9):
-            _sql.execute("INSERT INTO " + table + " (day, period) VALUES (%s, %s)", [i, j])
+    _sql.executemany("INSERT INTO " + table + " (day, period) VALUES (%s, %s)",
+                     [[i, j] for i in ["mon", "tue", "wed", "thu", "fri", "sat"] for j in range(1, 9)])
 
 # Main function
 # It all began here ...
-def update_db():
+#
+# Returns the rows loaded and rejected for each table. See load_report
+#
+# @param data_dir -- Directory having the CSV files
+@instrument.timed
+def update_db(data_dir: str = "data"):
     _log.info("===== Beginning databse update =====")
 
     # Initialise for data update
+    # Cancelling (see progress.py) after this leaves the tables partly loaded, until the next update
+    progress.report("loading", done = 0, steps = 6, table = "subjects")
     _initialise_db()
+    load_report.clear()
 
     # Load the records ...
-    load_records_from_file("data/subjects.csv", "subjects")
-    load_records_from_file("data/teachers.csv", "teachers")
-    load_records_from_file("data/periodsperweek.csv", "periods_per_week")
-    _load_subject_data("data/subjectdata.csv", "subject_teachers")
+    load_records_from_file(os.path.join(data_dir, "subjects.csv"), "subjects")
+    progress.report("loading", done = 1, steps = 6, table = "teachers")
+    load_records_from_file(os.path.join(data_dir, "teachers.csv"), "teachers")
+    progress.report("loading", done = 2, steps = 6, table = "periods_per_week")
+    load_records_from_file(os.path.join(data_dir, "periodsperweek.csv"), "periods_per_week")
+    progress.report("loading", done = 3, steps = 6, table = "subject_teachers")
+    _load_subject_data(os.path.join(data_dir, "subjectdata.csv"), "subject_teachers")
+    progress.report("loading", done = 4, steps = 6, table = "periods")
     _add_periods("periods")
     _sql_conn.commit()
 
+    for table, counts in load_report.items():
+        _log.info("Table %s: %s rows loaded, %s rejected.", table, counts["loaded"], counts["rejected"])
+
+    progress.report("loading", done = 5, steps = 6, table = "subject_teachers (assigning teachers)")
     assignteachers.assign_teachers()
     _sql_conn.commit()
 
-    _sql.close()
-    _sql_conn.close()
     _log.info("===== Database update completed =====")
+    return load_report
 
 _log = logmaster.getLogger() # Logger
-_sql_conn = connect.connect_to_db()  # MySQL connection handler -- intended to be public.
-_sql = _sql_conn.cursor()     # MySQL cursor
+_sql_conn = connect.shared   # The shared connection -- intended to be public.
+_sql = connect.LazyCursor()  # Cursor, opened on first use
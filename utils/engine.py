@@ -0,0 +1,400 @@
+# The in-memory timetable engine.
+#
+# Does what create_timetable() in main.py does, but instead of asking MySQL
+# whether every single period is free, it keeps track of who is busy when
+# in bitsets (one bit for each of the 48 slots in a week) and writes the
+# finished timetable to the database in one go.
+#
+# NOTES:
+# 'slot' is the position of a period in the week, 0 to 47. Monday's first
+# period is slot 0, Saturday's last is slot 47. See problem.slot_of()
+
+import random
+from utils import logmaster
+from utils import persist
+from utils import problem as prob
+from utils import instrument
+from utils import progress
+
+_log = logmaster.getLogger()
+
+# Days of the week. This order supports even spread of the rarer subjects
+FILL_ORDER = ["mon", "wed", "fri", "tue", "thu", "sat"]
+
+# CCA periods: the first two periods on a saturday
+CCA_SLOTS = (prob.slot_of("sat", 1), prob.slot_of("sat", 2))
+
+# The timetable being made, kept entirely in memory.
+#
+# cells         -- class -> list of 48 (subject, teacher) tuples or None
+# class_busy    -- class -> bitset of occupied slots
+# teacher_busy  -- teacher -> bitset of occupied slots
+# teacher_cells -- teacher -> {slot: class}, to find whom a teacher is with without searching
+#
+# A cell may hold an elective group (see problem.py). Its teachers are each booked in
+# teacher_busy and teacher_cells, and `teacher` may be a group wherever one is asked for.
+class Timetable:
+    def __init__(self, classes):
+        self.cells = {cls: [None] * prob.SLOTS for cls in classes}
+        self.class_busy = {cls: 0 for cls in classes}
+        self.teacher_busy = {}
+        self.teacher_cells = {}
+
+    # The slots the teacher, or any teacher of the group, is busy in
+    def busy(self, teacher: str):
+        if teacher is None or prob.GROUP_SEPARATOR not in teacher:
+            return self.teacher_busy.get(teacher, 0)
+        busy = 0
+        for member in prob.members(teacher):
+            busy |= self.teacher_busy.get(member, 0)
+        return busy
+
+    # Whether both the class and the teacher are free in all of `mask`
+    def is_free(self, class_name: str, teacher: str, mask: int):
+        return not ((self.class_busy[class_name] | self.busy(teacher)) & mask)
+
+    # Whether the teacher is free in the slot
+    def teacher_free(self, teacher: str, slot: int):
+        return not (self.busy(teacher) >> slot) & 1
+
+    def place(self, class_name: str, slot: int, subject: str, teacher: str):
+        self.cells[class_name][slot] = (subject, teacher)
+        self.class_busy[class_name] |= 1 << slot
+        if teacher is not None:
+            for member in prob.members(teacher):
+                self.teacher_busy[member] = self.teacher_busy.get(member, 0) | 1 << slot
+                self.teacher_cells.setdefault(member, {})[slot] = class_name
+
+    # Empties a slot of a class and returns what was in it
+    def remove(self, class_name: str, slot: int):
+        cell = self.cells[class_name][slot]
+        if cell is None:
+            return None
+        self.cells[class_name][slot] = None
+        self.class_busy[class_name] &= ~(1 << slot)
+        if cell[1] is not None:
+            for member in prob.members(cell[1]):
+                self.teacher_busy[member] &= ~(1 << slot)
+                self.teacher_cells[member].pop(slot, None)
+        return cell
+
+    # The empty slots of a class
+    def free_slots(self, class_name: str):
+        busy = self.class_busy[class_name]
+        return [slot for slot in range(prob.SLOTS) if not (busy >> slot) & 1]
+
+    # Number of periods of `subject` assigned to a class
+    def count(self, class_name: str, subject: str):
+        return sum(1 for cell in self.cells[class_name] if cell and cell[0] == subject)
+
+    # Checks if the slot is part of a block period, i.e. the period before or
+    # after it on the same day has the same subject
+    def is_block(self, class_name: str, slot: int):
+        row = self.cells[class_name]
+        if row[slot] is None:
+            return False
+        day_start = slot - slot % prob.PERIODS_PER_DAY
+        for other in (slot - 1, slot + 1):
+            if day_start <= other < day_start + prob.PERIODS_PER_DAY and row[other] and row[other][0] == row[slot][0]:
+                return True
+        return False
+
+    # A copy of the cells, to compare with later. See write_changes()
+    def copy_cells(self):
+        return {cls: list(row) for cls, row in self.cells.items()}
+
+    # All assignments as (class, subject, teacher, period ID) rows for table `timetable`
+    def rows(self, period_ids):
+        for cls, row in self.cells.items():
+            for slot, cell in enumerate(row):
+                if cell is not None:
+                    yield from _rows(cls, cell, period_ids[slot])
+
+# The rows of table `timetable` for a cell: one for each subject of an elective group
+def _rows(class_name: str, cell, period_id: int):
+    if not prob.is_group(cell[0]):
+        return [(class_name, cell[0], cell[1], period_id)]
+    return [(class_name, subject, teacher, period_id) for subject, teacher in zip(prob.members(cell[0]), prob.members(cell[1]))]
+
+# Gets `quantity` consecutive slots on `day` that are free for both class and teacher
+# or an empty list if it couldn't find a match. Same as get_periods() in main.py
+#
+# @param tt           -- The Timetable
+# @param quantity     -- The number of periods needed (together in a block)
+# @param class_name   -- ID of class
+# @param teacher      -- ID of teacher
+# @param day          -- The day
+# @param search_start -- Starts searching for period(s) from this period onwards
+def find_periods(tt: Timetable, quantity: int, class_name: str, teacher: str, day: str, search_start: int = 2, search_end: int = 8):
+    for i in range(search_start, search_end - quantity + 2):
+        first = prob.slot_of(day, i)
+        mask = ((1 << quantity) - 1) << first
+        if tt.is_free(class_name, teacher, mask):
+            return list(range(first, first + quantity))
+    return []
+
+# Gives the CCA periods to the class teacher of every class.
+def assign_cca_periods(problem: prob.Problem, tt: Timetable):
+    for cls in problem.classes:
+        for slot in CCA_SLOTS:
+            tt.place(cls, slot, "CCA", problem.class_teachers[cls])
+
+# Places periods for all class-subject combinations greedily. The same algorithm
+# as create_timetable() in main.py.
+#
+# Returns a list of (class, subject, teacher) tuples, one for every period that could not be placed
+@instrument.timed
+def place_all(problem: prob.Problem, tt: Timetable, max_attempts: int = 3):
+    block_period_days = {cls: set() for cls in problem.classes}
+    class_teacher_periods_assigned = set()
+    missing = []
+    # For progress reports: requirements of each class still to be placed
+    remaining_requirements = {cls: 0 for cls in problem.classes}
+    for req in problem.requirements:
+        remaining_requirements[req.class_name] += 1
+    classes_done = placed = 0
+
+    for done, req in enumerate(problem.requirements, 1):
+        cls, subject, teacher = req.class_name, req.subject, req.teacher
+        # CCA may already be assigned
+        remaining_periods = req.per_week - tt.count(cls, subject)
+
+        attempts = 0
+        while remaining_periods > 0 and attempts <= max_attempts:
+            for i, day in enumerate(FILL_ORDER):
+                start_from = 1 if (req.is_class_teacher or cls in class_teacher_periods_assigned) else 2
+
+                if req.intensity == "block" and remaining_periods > (len(FILL_ORDER) - i) \
+                        and not req.is_class_teacher and day not in block_period_days[cls]:
+                    slots = find_periods(tt, 2, cls, teacher, day, start_from)
+                else:
+                    slots = find_periods(tt, 1, cls, teacher, day, start_from)
+
+                if slots:
+                    remaining_periods -= len(slots)
+                    if len(slots) > 1:
+                        block_period_days[cls].add(day)
+                    placed += len(slots)
+                    for slot in slots:
+                        tt.place(cls, slot, subject, teacher)
+
+                if remaining_periods <= 0:
+                    break
+            else:
+                attempts += 1
+
+        if remaining_periods > 0:
+            _log.info("Ran out of attempts: Class '%s' subject '%s' taught by '%s'.", cls, subject, teacher)
+            missing += [(cls, subject, teacher)] * remaining_periods
+        elif req.is_class_teacher:
+            class_teacher_periods_assigned.add(cls)
+
+        remaining_requirements[cls] -= 1
+        if not remaining_requirements[cls]:
+            classes_done += 1
+        progress.report("placing", requirements_done = done, requirements = len(problem.requirements),
+                        classes_done = classes_done, classes = len(problem.classes), placed = placed, unassigned = len(missing))
+
+    return missing
+
+# Loads the timetable saved in table `timetable`
+#
+# @param cursor -- A cursor to read from
+@instrument.timed
+def load_timetable(cursor, problem: prob.Problem):
+    slots = {period_id: slot for slot, period_id in enumerate(problem.period_ids)}
+    tt = Timetable(problem.classes)
+    cursor.execute("SELECT class, subject, teacher, period FROM timetable;")
+    # More than one row in a period of a class is an elective group
+    found = {}
+    for cls, subject, teacher, period_id in cursor.fetchall():
+        found.setdefault((cls, slots[period_id]), []).append((subject, teacher))
+    for (cls, slot), cells in found.items():
+        tt.place(cls, slot, *prob.group(cells))
+    return tt
+
+# Lists the periods that are yet to be placed
+#
+# Returns a list of (class, subject, teacher) tuples, one for every period
+def find_missing(problem: prob.Problem, tt: Timetable):
+    missing = []
+    for req in problem.requirements:
+        missing += [(req.class_name, req.subject, req.teacher)] * max(req.per_week - tt.count(req.class_name, req.subject), 0)
+    return missing
+
+# ----------- REPAIR -----------
+#
+# Places the periods the greedy pass couldn't. Think of the timetable as a graph with
+# classes on one side and teachers on the other, and every period an edge between a
+# class and its teacher, coloured with its slot. A valid timetable is one where no two
+# edges of a class or a teacher have the same colour. A missing period is an edge with
+# no colour yet.
+#
+# Say the class is free in slot `alpha` and the teacher in slot `beta`, but neither is free
+# in both. Follow the path: the teacher's period in `alpha` (with some class), that class's
+# period in `beta` (with some teacher), that teacher's period in `alpha`... and so on until
+# it stops. Swapping `alpha` and `beta` for every class on the path keeps everyone clash-free
+# and leaves both the class and the teacher free in `alpha`. The path can never come back
+# to the class, so this always works. Likewise, starting from the class's period in `beta`
+# frees up `beta` for both.
+#
+# Paths that would move a block period apart are not taken, nor are the CCA periods ever
+# moved. Another pair of slots is tried instead.
+
+# Places as many of the missing periods as it can.
+#
+# Returns the periods that still could not be placed
+#
+# @param missing -- List of (class, subject, teacher) tuples
+@instrument.timed
+def repair(tt: Timetable, missing: list):
+    still_missing = []
+    for i, (cls, subject, teacher) in enumerate(missing):
+        if not _place_with_path(tt, cls, subject, teacher):
+            still_missing.append((cls, subject, teacher))
+        progress.report("repairing", done = i + 1, missing = len(missing), unassigned = len(missing) - (i + 1 - len(still_missing)))
+    return still_missing
+
+# Places one period, swapping periods of other classes around if needed.
+# Returns whether the period was placed.
+def _place_with_path(tt: Timetable, cls: str, subject: str, teacher: str):
+    class_free = [slot for slot in tt.free_slots(cls) if slot not in CCA_SLOTS]
+
+    # Maybe it fits as it is
+    for slot in class_free:
+        if tt.teacher_free(teacher, slot):
+            tt.place(cls, slot, subject, teacher)
+            return True
+
+    teacher_free = [slot for slot in range(prob.SLOTS) if slot not in CCA_SLOTS and tt.teacher_free(teacher, slot)]
+
+    # Shortest path first, as that moves the fewest periods
+    best = None
+    for alpha in class_free:
+        for beta in teacher_free:
+            # From the teacher's side, freeing `alpha`. Not for an elective group: its
+            # teachers would each need a path of their own
+            if not prob.is_group(teacher):
+                path = _alternating_path(tt, [], teacher, alpha, beta)
+                if path is not None and (best is None or len(path) < len(best[0])):
+                    best = (path, alpha, beta, alpha)
+
+            # From the class's side, freeing `beta`
+            if not tt.is_block(cls, beta) and not prob.is_group(tt.cells[cls][beta][1]):
+                path = _alternating_path(tt, [cls], tt.cells[cls][beta][1], alpha, beta)
+                if path is not None and (best is None or len(path) < len(best[0])):
+                    best = (path, alpha, beta, beta)
+
+            if best and len(best[0]) == 1:
+                break
+        if best and len(best[0]) == 1:
+            break
+
+    if best is None:
+        return False
+
+    path, alpha, beta, slot = best
+    # Empty out everything first, so nobody is double booked halfway through
+    moved = [(c, tt.remove(c, alpha), tt.remove(c, beta)) for c in path]
+    for c, cell_alpha, cell_beta in moved:
+        if cell_alpha:
+            tt.place(c, beta, *cell_alpha)
+        if cell_beta:
+            tt.place(c, alpha, *cell_beta)
+    tt.place(cls, slot, subject, teacher)
+
+    _log.info("Placed %s for %s in slot %s by swapping slots %s and %s of %s.", teacher, cls, slot, alpha, beta, ", ".join(path))
+    return True
+
+# Follows the path of periods alternately in slots `alpha` and `beta`, starting from
+# the teacher's period in `alpha`. Returns the classes on the path (after `path`, the
+# ones already on it), or None if it runs into a block period or an elective group
+def _alternating_path(tt: Timetable, path: list, teacher: str, alpha: int, beta: int):
+    path = list(path)
+    while teacher is not None:
+        cls = tt.teacher_cells.get(teacher, {}).get(alpha)
+        if cls is None:
+            break
+        if tt.is_block(cls, alpha) or tt.is_block(cls, beta) or len(path) > len(tt.cells):
+            return None
+        # The other teachers of a group may not be free in the slot it would move to
+        cell = tt.cells[cls][beta]
+        if prob.is_group(tt.cells[cls][alpha][1]) or (cell and prob.is_group(cell[1])):
+            return None
+        path.append(cls)
+
+        # The teacher this class has in `beta` is the next one along
+        teacher = cell[1] if cell else None
+    return path
+
+# A copy of the problem with the class-subject combinations in a random order,
+# class teachers' still first. Different orders make different timetables.
+#
+# @param seed -- Seed for the random order. The same seed gives the same order.
+def shuffle(problem: prob.Problem, seed: int):
+    requirements = list(problem.requirements)
+    random.Random(seed).shuffle(requirements)
+    requirements.sort(key = lambda r: not r.is_class_teacher)
+    return problem._replace(requirements = tuple(requirements))
+
+# Makes a complete timetable in memory
+#
+# Returns the Timetable and the list of periods that could not be placed
+#
+# @param seed -- If given, the class-subject combinations are placed in a random order. See shuffle()
+@instrument.timed
+def solve(problem: prob.Problem, seed: int = None):
+    if seed is not None:
+        problem = shuffle(problem, seed)
+
+    tt = Timetable(problem.classes)
+    assign_cca_periods(problem, tt)
+
+    missing = place_all(problem, tt)
+    _log.info("Totally, %s periods off. Fixing...", len(missing))
+
+    missing = repair(tt, missing)
+    for cls, subject, teacher in missing:
+        _log.error("Could not assign a period of class %s subject %s taught by %s.", cls, subject, teacher)
+
+    if missing:
+        _log.error("Totally, %s periods off.", len(missing))
+    else:
+        _log.info("All periods were assigned. Good to go!")
+    return tt, missing
+
+# Replaces whatever is in table `timetable` with the timetable, in one transaction
+#
+# @param sql_conn -- The database connection
+@instrument.timed
+def save(sql_conn, problem: prob.Problem, tt: Timetable):
+    with persist.TimetableWriter(sql_conn) as writer:
+        writer.clear()
+        for row in tt.rows(problem.period_ids):
+            writer.insert(*row)
+
+# Writes only the cells that changed since `before`
+#
+# @param writer -- The persist.TimetableWriter to write with
+# @param before -- The cells as they were, from Timetable.copy_cells()
+def write_changes(writer: persist.TimetableWriter, problem: prob.Problem, before: dict, tt: Timetable):
+    changes = 0
+    for cls, row in tt.cells.items():
+        for slot, cell in enumerate(row):
+            if cell == before[cls][slot]:
+                continue
+            changes += 1
+            period_id = problem.period_ids[slot]
+            if cell is None:
+                writer.delete(cls, period_id)
+            elif before[cls][slot] is None:
+                for row in _rows(cls, cell, period_id):
+                    writer.insert(*row)
+            elif prob.is_group(cell[0]) or prob.is_group(before[cls][slot][0]):
+                # Not the same number of rows
+                writer.delete(cls, period_id)
+                for row in _rows(cls, cell, period_id):
+                    writer.insert(*row)
+            else:
+                writer.update(cls, period_id, cell[0], cell[1])
+    return changes
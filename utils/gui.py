@@ -1,6 +1,12 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import csv
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import snapshot
+from utils import progress
 
 # Read the class timetables from CSV file
 # 
@@ -78,97 +84,356 @@ def read_teacher_csv(filename):
 
     return timetables
 
-# Display the timetable in a new window
+HEADERS = ["Day", "1", "2", "3", "4", "5", "6", "7", "8"]
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+
+# Rows of a timetable from the 48 cells of a week
+def _rows(cells):
+    return [[day] + cells[i * 8:(i + 1) * 8] for i, day in enumerate(DAYS)]
+
+# Where the timetables come from: the snapshot (see snapshot.py) if there is one, else the CSV files.
 #
-# @param headers -- List of column headers
-# @param data -- List of rows (each row is a list of values)
-# @param title -- Title of the window
-def show_timetable(headers, data, title):
-    win = tk.Toplevel()
-    win.title(title)
-    win.geometry("1000x190")
-    win.config(bg="#1E2761")
+# A snapshot gives the names straight away and each timetable when it is asked for. The CSV
+# files have to be read whole, so they are, the first time anything is asked for.
+# Everything is kept once read. Not thread safe; the GUI calls it from one worker thread.
+class TimetableSource:
+    # @param snapshot_file -- Path to the snapshot
+    # @param classes_file  -- Path to the class timetables CSV file, if there is no snapshot
+    # @param teachers_file -- Path to the teacher timetables CSV file, if there is no snapshot
+    def __init__(self, snapshot_file: str = "timetable.snap", classes_file: str = "ctt.csv", teachers_file: str = "ttt.csv"):
+        self._snapshot_file = snapshot_file
+        self._csv_files = {"class": classes_file, "teacher": teachers_file}
+        self._snap = None
+        self._timetables = {"class": {}, "teacher": {}} # kind -> name -> (headers, data)
+        self._names = None
+
+    # The class names and the teacher names, as two sorted lists
+    def names(self):
+        if self._names is None:
+            if os.path.exists(self._snapshot_file):
+                try:
+                    self._snap = snapshot.Snapshot(self._snapshot_file)
+                except ValueError: # Made by an older version; the CSV files will do until the next export
+                    self._snap = None
+            if self._snap is not None:
+                self._names = sorted(self._snap.classes), sorted(self._snap.teachers)
+            else:
+                self._timetables["class"] = read_class_csv(self._csv_files["class"])
+                self._timetables["teacher"] = read_teacher_csv(self._csv_files["teacher"])
+                self._names = list(self._timetables["class"]), list(self._timetables["teacher"])
+        return self._names
+
+    # A timetable as (headers, rows), or None if there's no such one
+    #
+    # @param kind -- "class" or "teacher"
+    # @param name -- ID of the class or teacher
+    def timetable(self, kind: str, name: str):
+        self.names()
+        cached = self._timetables[kind]
+        if name not in cached and self._snap is not None:
+            try:
+                if kind == "class":
+                    cells = [f"{cell[0]} ({cell[1]})" if cell else "" for cell in self._snap.class_cells(name)]
+                else:
+                    cells = [cls or "" for cls in self._snap.teacher_cells(name)]
+            except KeyError:
+                return None
+            cached[name] = (HEADERS, _rows(cells))
+        return cached.get(name)
+
+    def close(self):
+        if self._snap is not None:
+            self._snap.close()
+            self._snap = None
+
+    # Forgets everything read, to read the files again. Eg: after a new timetable was made
+    # Returns the names, like names()
+    def reload(self):
+        self.close()
+        self._timetables = {"class": {}, "teacher": {}}
+        self._names = None
+        return self.names()
+
+# Runs work in a background thread and hands the results to the GUI thread, since
+# tkinter may only be used from the thread it was started in
+class Worker:
+    def __init__(self, root):
+        self._root = root
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._done = queue.Queue()
+        self._poll()
+
+    # Calls `work()` in the background, then `done(result)` in the GUI thread
+    def submit(self, work, done):
+        future = self._pool.submit(work)
+        future.add_done_callback(lambda future: self._done.put((done, future)))
+
+    def _poll(self):
+        while not self._done.empty():
+            done, future = self._done.get()
+            try:
+                done(future.result())
+            except Exception as err:
+                messagebox.showerror("Error", str(err))
+        self._root.after(50, self._poll)
+
+    def shutdown(self):
+        # A read still going finishes before its source is closed
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+# A window showing one timetable at a time. Closing it only hides it, and
+# showing another timetable fills the same window again.
+class TimetableWindow:
+    def __init__(self, root):
+        self._root = root
+        self._win = None
+        self._tree = None
+
+    def _create(self):
+        self._win = tk.Toplevel(self._root)
+        self._win.geometry("1000x190")
+        self._win.config(bg="#1E2761")
+        self._win.protocol("WM_DELETE_WINDOW", self._win.withdraw)
+
+        frame = ttk.Frame(self._win, padding=10)
+        frame.pack(fill="both", expand=True)
+
+        self._tree = ttk.Treeview(frame, show="headings", columns=HEADERS)
+        for col in HEADERS:
+            self._tree.heading(col, text=col)
+            self._tree.column(col, width=100, anchor="center")
+        self._tree.pack(fill="both", expand=True)
+
+        # Add vertical scrollbar
+        scroll = ttk.Scrollbar(self._tree, orient="vertical", command=self._tree.yview)
+        scroll.pack(side="right", fill="y")
+        self._tree.configure(yscrollcommand=scroll.set)
+
+    # Display the timetable
+    #
+    # @param data  -- List of rows (each row is a list of values)
+    # @param title -- Title of the window
+    def show(self, data, title):
+        if self._win is None or not self._win.winfo_exists():
+            self._create()
+        self._win.title(title)
+        self._tree.delete(*self._tree.get_children())
+        for row in data:
+            self._tree.insert("", "end", values=row)
+        self._win.deiconify()
+        self._win.lift()
 
-    frame = ttk.Frame(win, padding=10)
-    frame.pack(fill="both", expand=True)
+# What the progress reports of a run look like: the message, and the fields that are the
+# bar's value and maximum. See progress.py
+_PROGRESS = {
+    "placing":    ("Placing periods: {classes_done}/{classes} classes, {placed} periods placed, {unassigned} unassigned",
+                   "requirements_done", "requirements"),
+    "repairing":  ("Fixing unassigned periods: {done}/{missing} tried, {unassigned} unassigned", "done", "missing"),
+    "starting":   ("Making timetables: {done}/{starts}, best score {best}", "done", "starts"),
+    "optimizing": ("Improving the timetable: {done}/{moves} moves, score {score}", "done", "moves"),
+    "saving":     ("Saving with {unassigned} unassigned periods...", None, None),
+    "loading":    ("Loading data: table {table}", "done", "steps"),
+    "assigning class teachers": ("Assigning class teachers...", None, None),
+}
 
-    tree = ttk.Treeview(frame, show="headings")
-    tree["columns"] = headers
+# What the status says once a run ends, for each kind of run: (done, cancelled, failed)
+_ENDINGS = {
+    "generate": ("New timetable made and saved.",
+                 "Cancelled. The old timetable was kept.",
+                 "Failed. The old timetable was kept."),
+    "load":     ("Data loaded. Generate a timetable from it.",
+                 "Cancelled. The data is only partly loaded; load it again before generating.",
+                 "Failed. The data may be only partly loaded; load it again before generating."),
+}
 
-    for col in headers:
-        tree.heading(col, text=col)
-        tree.column(col, width=100, anchor="center")
+# Makes a new timetable (or loads the data) in a thread of its own, showing how it's going,
+# with a button to cancel it
+class GeneratePanel:
+    # @param generate -- Makes and exports the timetable. See generate_and_export() in main.py
+    # @param row      -- Grid row of the root window to start from
+    # @param finished -- Called in the GUI thread after a run that made a new timetable
+    # @param load     -- If given, a Load button runs this. See load_and_assign() in main.py
+    def __init__(self, root, generate, row: int, finished, load = None):
+        self._root = root
+        self._work = {"generate": generate, "load": load}
+        self._finished = finished
+        self._events = queue.Queue()
+        self._thread = None
+        self._kind = None
 
-    for row in data:
-        tree.insert("", "end", values=row)
+        buttons = tk.Frame(root, bg="#1E2761")
+        buttons.grid(column=1, columnspan=2, row=row, sticky=(tk.W, tk.E))
+        self._start_buttons = []
+        for kind in ("load", "generate"):
+            if self._work[kind] is None:
+                continue
+            button = tk.Button(buttons, text=kind.capitalize(), font=("Helvetica", 12, "bold"), bg="yellow", command=lambda kind=kind: self.start(kind))
+            button.pack(side="left", fill="x", expand=True)
+            self._start_buttons.append(button)
+        self._cancel_button = tk.Button(buttons, text="Cancel", font=("Helvetica", 12, "bold"), state="disabled", command=self.cancel)
+        self._cancel_button.pack(side="left", fill="x", expand=True)
+        self._bar = ttk.Progressbar(root, mode="determinate")
+        self._bar.grid(column=1, columnspan=2, row=row + 1, sticky=(tk.W, tk.E))
+        self._status = tk.Label(root, text="", font=("Helvetica", 10), fg="white", bg="#1E2761", anchor="w", wraplength=460, justify="left")
+        self._status.grid(column=1, columnspan=2, row=row + 2, sticky=(tk.W, tk.E))
 
-    tree.pack(fill="both", expand=True)
+    # @param kind -- "generate" or "load"
+    def start(self, kind: str = "generate"):
+        if self._thread is not None:
+            return
+        self._kind = kind
+        progress.reset()
+        progress.listen(lambda event, fields: self._events.put((event, fields)))
+        self._thread = threading.Thread(target=self._run, args=(self._work[kind],), daemon=True)
+        self._thread.start()
+        for button in self._start_buttons:
+            button.config(state="disabled")
+        self._cancel_button.config(state="normal")
+        self._bar.config(value=0)
+        self._status.config(text="Starting...")
+        self._poll()
 
-    # Add vertical scrollbar
-    scroll = ttk.Scrollbar(tree, orient="vertical", command=tree.yview)
-    scroll.pack(side="right", fill="y")
-    tree.configure(yscrollcommand=scroll.set)
+    # Stops the run at its next progress report. The old timetable is kept.
+    # A load leaves the data partly loaded.
+    def cancel(self):
+        progress.cancel()
+        self._cancel_button.config(state="disabled")
+        self._status.config(text="Cancelling...")
+
+    # Once the window is closed: cancels a run still going, which keeps the old timetable, and waits
+    # for it to finish. The run has the database connection until then; it closes it itself.
+    def stop(self):
+        progress.cancel()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # In the run's thread
+    def _run(self, work):
+        try:
+            work()
+            self._events.put(("done", {}))
+        except progress.Cancelled:
+            self._events.put(("cancelled", {}))
+        except Exception as err:
+            self._events.put(("failed", {"error": err}))
+
+    def _poll(self):
+        # Only the latest report is shown; there may be hundreds since the last poll
+        last = None
+        while not self._events.empty():
+            last = self._events.get()
+            if last[0] in ("done", "cancelled", "failed"):
+                break
+        if last is not None:
+            self._show(*last)
+        if self._thread is not None:
+            self._root.after(100, self._poll)
+
+    def _show(self, event, fields):
+        if event in _PROGRESS:
+            message, value, maximum = _PROGRESS[event]
+            self._status.config(text=message.format(**fields))
+            if value:
+                self._bar.config(maximum=max(fields[maximum], 1), value=fields[value])
+            if event == "saving":
+                # Too late to cancel: the new timetable is being written
+                self._cancel_button.config(state="disabled")
+            return
+
+        self._thread = None
+        progress.listen(None)
+        for button in self._start_buttons:
+            button.config(state="normal")
+        self._cancel_button.config(state="disabled")
+        done, cancelled, failed = _ENDINGS[self._kind]
+        if event == "done":
+            self._bar.config(maximum=1, value=1)
+            self._status.config(text=done)
+            if self._kind == "generate":
+                self._finished()
+        elif event == "cancelled":
+            self._bar.config(value=0)
+            self._status.config(text=cancelled)
+        else:
+            self._bar.config(value=0)
+            self._status.config(text=failed)
+            messagebox.showerror("Error", str(fields["error"]))
 
 # Button stuff :)
 #
-# @param class_var -- Tkinter StringVar for class selection
-# @param class_tts -- Dictionary of class timetables
-def load_class_tt(class_var, class_tts):
-    name = class_var.get().strip()
+# @param kind   -- "class" or "teacher"
+# @param var    -- Tkinter StringVar of the selection
+# @param source -- The TimetableSource
+# @param worker -- The Worker to load in
+# @param window -- The TimetableWindow to show it in
+def load_tt(kind, var, source, worker, window):
+    name = var.get().strip()
     if not name:
-        messagebox.showwarning("Input", "Please select a class.")
+        messagebox.showwarning("Input", f"Please select a {kind}.")
         return
-    if name not in class_tts:
-        messagebox.showerror("Not Found", f"No timetable found for class {name}.")
-        return
-    headers, data = class_tts[name]
-    show_timetable(headers, data, f"Class Timetable - {name}")
 
-def load_teacher_tt(teacher_var, teacher_tts):
-    name = teacher_var.get().strip()
-    if not name:
-        messagebox.showwarning("Input", "Please select a teacher.")
-        return
-    if name not in teacher_tts:
-        messagebox.showerror("Not Found", f"No timetable found for teacher {name}.")
-        return
-    headers, data = teacher_tts[name]
-    show_timetable(headers, data, f"Teacher Timetable - {name}")
+    def done(timetable):
+        if timetable is None:
+            messagebox.showerror("Not Found", f"No timetable found for {kind} {name}.")
+            return
+        window.show(timetable[1], f"{kind.capitalize()} Timetable - {name}")
+
+    worker.submit(lambda: source.timetable(kind, name), done)
 
 # The main GUI function
-def main():
+#
+# @param generate -- If given, a panel to make a new timetable is shown, which runs this. See GeneratePanel
+# @param load     -- If given too, the panel can also load the data with this
+def main(generate = None, load = None):
     root = tk.Tk()
     root.title("Timetables")
-    root.geometry("500x300")
+    root.geometry("500x420" if generate else "500x300")
     root.config(bg="#1E2761")  # Deep blue background
 
-    # Load CSVs
-    class_tts = read_class_csv("ctt.csv")
-    teacher_tts = read_teacher_csv("ttt.csv")
+    # The window shows up first; the names are filled in once read
+    source = TimetableSource()
+    worker = Worker(root)
+    windows = {"class": TimetableWindow(root), "teacher": TimetableWindow(root)}
 
     # --- Class section ---
     tk.Label(root, text="Class", font=("Helvetica", 18, "bold"), fg="white", bg="#1E2761").grid(column=1, row=1, sticky=(tk.W, tk.E))
     class_var = tk.StringVar()
-    class_menu = ttk.Combobox(root, textvariable=class_var, values=list(class_tts.keys()),
+    class_menu = ttk.Combobox(root, textvariable=class_var, values=[],
                               font=("Helvetica", 14), width=15, state="readonly")
     class_menu.grid(column=2, row=1, sticky=(tk.W, tk.E))
     tk.Button(root, text="Show Timetable", font=("Helvetica", 12, "bold"), bg="yellow",
-              command=lambda: load_class_tt(class_var, class_tts)).grid(column=1, columnspan=2, row=2, sticky=(tk.W, tk.E))
+              command=lambda: load_tt("class", class_var, source, worker, windows["class"])).grid(column=1, columnspan=2, row=2, sticky=(tk.W, tk.E))
 
     tk.Label(root, text="", font=("Helvetica", 14, "bold"), fg="white", bg="#1E2761").grid(column=1, columnspan=2, row=3, sticky=(tk.E, tk.W))
 
     # --- Teacher section ---
     tk.Label(root, text="Teacher", font=("Helvetica", 18, "bold"), fg="white", bg="#1E2761").grid(column=1, row=4, sticky=(tk.W, tk.E))
     teacher_var = tk.StringVar()
-    teacher_menu = ttk.Combobox(root, textvariable=teacher_var, values=list(teacher_tts.keys()),
+    teacher_menu = ttk.Combobox(root, textvariable=teacher_var, values=[],
                               font=("Helvetica", 14), width=15, state="readonly")
     teacher_menu.grid(column=2, row=4, sticky=(tk.W, tk.E))
     tk.Button(root, text="Show Timetable", font=("Helvetica", 12, "bold"), bg="yellow",
-              command=lambda: load_teacher_tt(teacher_var, teacher_tts)).grid(column=1, columnspan=2, row=5, sticky=(tk.W, tk.E))
+              command=lambda: load_tt("teacher", teacher_var, source, worker, windows["teacher"])).grid(column=1, columnspan=2, row=5, sticky=(tk.W, tk.E))
+
+    def names_loaded(names):
+        class_menu["values"], teacher_menu["values"] = names
+
+    # --- Generate section ---
+    panel = None
+    if generate:
+        # The new timetable is read again in the worker, after any loads still waiting
+        panel = GeneratePanel(root, generate, 6, lambda: worker.submit(source.reload, names_loaded), load)
 
     root.columnconfigure(2, weight=1)
     root.rowconfigure(5, weight=1)
     for i in root.winfo_children():
         i.grid_configure(padx=15, pady=10)
 
+    worker.submit(source.names, names_loaded)
+
     root.mainloop()
+    if panel is not None:
+        panel.stop()
+    worker.shutdown()
+    source.close()
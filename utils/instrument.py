@@ -0,0 +1,152 @@
+# Keeps track of where the time and the SQL statements go.
+#
+# The shared connection (see connect.py) is wrapped so that its cursors count every
+# statement, the rows fetched and the rows written. Functions marked with @timed record
+# how long they took and what they sent to the database, including everything done by
+# functions they call. Eg:
+#
+#     @instrument.timed
+#     def update_db(data_dir: str = "data"):
+#
+# At the end of a run, summary() has it all and save() writes it to a JSON file, by
+# default next to the session's log.
+#
+# A function called from within itself is only counted once. Statements count towards the
+# timed functions running in the thread that sent them (Eg: the GUI's generate thread).
+
+import json
+import threading
+import time
+from functools import wraps
+from utils import logmaster
+
+_log = logmaster.getLogger()
+
+# Statements that write rows
+_WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_started = time.perf_counter()
+_totals = {"statements": 0, "rows_fetched": 0, "rows_written": 0}
+_records = {} # name -> {"calls", "seconds", "statements", "rows_fetched", "rows_written"}
+_lock = threading.Lock() # For the counts above, which every thread adds to
+_local = threading.local()
+
+# The timed functions running in this thread: name -> how deep in calls to it we are
+def _active():
+    if not hasattr(_local, "active"):
+        _local.active = {}
+    return _local.active
+
+# Adds to a count of the whole run and of every timed function running in this thread
+def _count(key: str, n: int):
+    with _lock:
+        _totals[key] += n
+        for name in _active():
+            _records[name][key] += n
+
+# Records the time and statements of every call to the function, under its name
+def timed(function):
+    name = function.__qualname__ if function.__module__ == "__main__" else f"{function.__module__.split('.')[-1]}.{function.__qualname__}"
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            record = _records.setdefault(name, {"calls": 0, "seconds": 0.0, "statements": 0, "rows_fetched": 0, "rows_written": 0})
+            record["calls"] += 1
+        active = _active()
+        if name in active: # Called from within itself
+            active[name] += 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                active[name] -= 1
+
+        active[name] = 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with _lock:
+                record["seconds"] += time.perf_counter() - start
+            del active[name]
+    return wrapper
+
+# Counts so far of the whole run: statements, rows fetched and rows written
+def totals():
+    with _lock:
+        return dict(_totals)
+
+# Everything recorded, as a dictionary fit for JSON
+def summary():
+    with _lock:
+        return {
+            "seconds": round(time.perf_counter() - _started, 4),
+            **_totals,
+            "functions": {name: {**record, "seconds": round(record["seconds"], 4)} for name, record in _records.items()},
+        }
+
+# Writes summary() to a JSON file
+#
+# @param file_path -- Where to save. Next to the session's log if None. Eg: logs/10-42-07.json
+def save(file_path: str = None):
+    file_path = file_path or logmaster.session_log().rsplit(".", 1)[0] + ".json"
+    with open(file_path, "w") as file:
+        json.dump(summary(), file, indent=4)
+    _log.info("Saved timings and SQL counts to %s", file_path)
+
+# Wraps a connection so its cursors count what they do
+def wrap(conn):
+    return _Connection(conn)
+
+class _Connection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return _Cursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class _Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _executed(self, query: str):
+        _count("statements", 1)
+        if query.lstrip().upper().startswith(_WRITES) and self._cursor.rowcount > 0:
+            _count("rows_written", self._cursor.rowcount)
+
+    def execute(self, query: str, params=()):
+        result = self._cursor.execute(query, params)
+        self._executed(query)
+        return result
+
+    def executemany(self, query: str, seq_params):
+        result = self._cursor.executemany(query, seq_params)
+        self._executed(query)
+        return result
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            _count("rows_fetched", 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        _count("rows_fetched", len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        _count("rows_fetched", len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            _count("rows_fetched", 1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
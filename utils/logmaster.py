@@ -1,14 +1,85 @@
+import atexit
 import logging
+import os
+import queue
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Logging goes through a queue: the program only puts records on it, and a thread of the
+# listener writes them to the file. So nothing waits for the disk, however much is logged.
+# Records below the level are dropped before anything is formatted; log with %s arguments
+# rather than f-strings so that's true of debug messages in loops too.
 
 _CURR_SESSION_LOG = "logs/" + str(datetime.now().strftime("%H-%M-%S")) + ".log"
+_FORMAT = "%(levelname)s: %(filename)s: %(funcName)s: %(message)s"
+
+DEFAULT_LEVEL = "INFO"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+_queue = queue.SimpleQueue()
+_listener = None
+_file_handler = None
+
+# (Re)starts logging to a file
+#
+# @param level     -- Lowest level logged. Eg: "DEBUG", "INFO", "WARNING"
+# @param file_path -- The log file. This session's file in logs/ if None
+# @param max_bytes -- The file is rotated (file.1, file.2 ...) once this big. Never if 0
+# @param backups   -- Number of rotated files kept
+def configure(level: str = None, file_path: str = None, max_bytes: int = None, backups: int = None):
+    global _CURR_SESSION_LOG, _listener, _file_handler
+    level = (level or DEFAULT_LEVEL).upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Unknown log level '{level}'.")
+    if file_path:
+        _CURR_SESSION_LOG = file_path
+
+    # Whatever is queued goes to the old file first
+    if _listener is not None:
+        _listener.stop()
+        _file_handler.close()
 
-logging.basicConfig(
-    filename=_CURR_SESSION_LOG,
-    filemode='a',
-    format="%(levelname)s: %(filename)s: %(funcName)s: %(message)s",
-    level=logging.DEBUG
-)
+    _file_handler = RotatingFileHandler(_CURR_SESSION_LOG, mode="a",
+                                        maxBytes=DEFAULT_MAX_BYTES if max_bytes is None else max_bytes,
+                                        backupCount=DEFAULT_BACKUPS if backups is None else backups, delay=True)
+    _file_handler.setFormatter(logging.Formatter(_FORMAT))
+    _listener = QueueListener(_queue, _file_handler)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        root.addHandler(QueueHandler(_queue))
+
+# Writes out everything queued and stops the listener. Called at exit
+def shutdown():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _file_handler.close()
+        _listener = None
+
+# Worker processes (see multistart.py) don't get the listener's thread, and may exit
+# without running atexit, so they write to the file themselves
+def _after_fork():
+    global _listener
+    _listener = None
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    handler = logging.FileHandler(_CURR_SESSION_LOG, mode="a")
+    handler.setFormatter(logging.Formatter(_FORMAT))
+    root.addHandler(handler)
+
+configure()
+atexit.register(shutdown)
+os.register_at_fork(after_in_child=_after_fork)
 
 def getLogger():
     return logging.getLogger()
+
+# Path of this session's log file
+def session_log():
+    return _CURR_SESSION_LOG
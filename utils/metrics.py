@@ -0,0 +1,127 @@
+# Measures how good a timetable is, for comparing runs.
+#
+# The timetable is turned into NumPy arrays (classes x 48 slots of subjects and teachers,
+# teachers x 48 slots of busy or not) and everything is measured on whole arrays at once,
+# so even thousands of classes take a fraction of a second. The measures:
+#   - unassigned    -- periods that couldn't be placed
+#   - bunching      -- periods of a subject beyond a class's daily limit, and split blocks.
+#                      Same as in score.py
+#   - split_blocks  -- days on which a block subject has 2 periods that aren't back to back
+#   - blocks        -- block periods (2 back to back periods of a block subject)
+#   - ct_absent     -- days on which a class doesn't see its class teacher
+#   - gaps          -- free periods teachers sit through between their first and last period of a day
+#   - peak_load     -- the most periods any teacher has in a day
+#   - mean_peak     -- the average of every teacher's busiest day
+#   - score         -- the weighted total of score.py, so it can be compared with score.score()
+#
+# Per class and per teacher numbers are kept too. See measure().
+
+import numpy as np
+from utils import score
+from utils import problem as prob
+from utils import instrument
+
+DAYS = len(prob.DAYS)
+PPD = prob.PERIODS_PER_DAY
+
+# Turns a timetable into arrays
+#
+# Returns (subjects, teachers, subject_ids, teacher_ids) where
+#   subjects    -- classes x 48 array of indices into subject_ids, -1 for free periods
+#   teachers    -- classes x 48 array of indices into teacher_ids, -1 for free periods
+#   subject_ids -- List of subject IDs
+#   teacher_ids -- List of teacher IDs
+#
+# @param tt -- The engine.Timetable
+def to_arrays(problem: prob.Problem, tt):
+    subject_ids = sorted({req.subject for req in problem.requirements} | {cell[0] for row in tt.cells.values() for cell in row if cell})
+    teacher_ids = sorted(set(problem.teacher_subject) | set(tt.teacher_busy))
+    subject_index = {subject: i for i, subject in enumerate(subject_ids)}
+    teacher_index = {teacher: i for i, teacher in enumerate(teacher_ids)}
+    teacher_index[None] = -1
+
+    subjects = np.full((len(problem.classes), prob.SLOTS), -1, dtype=np.int32)
+    teachers = np.full((len(problem.classes), prob.SLOTS), -1, dtype=np.int32)
+    for c, cls in enumerate(problem.classes):
+        row = tt.cells[cls]
+        subjects[c] = [subject_index[cell[0]] if cell else -1 for cell in row]
+        # An elective group has no single teacher either
+        teachers[c] = [teacher_index.get(cell[1], -1) if cell else -1 for cell in row]
+    return subjects, teachers, subject_ids, teacher_ids
+
+# Measures a timetable
+#
+# Returns a dictionary of the measures listed at the top, plus
+#   per_class   -- class -> {"bunching", "ct_absent"}
+#   per_teacher -- teacher -> {"gaps", "peak_load"}
+#
+# @param tt -- The engine.Timetable
+@instrument.timed
+def measure(problem: prob.Problem, tt):
+    subjects, teachers, subject_ids, teacher_ids = to_arrays(problem, tt)
+    n_classes, n_subjects, n_teachers = len(problem.classes), len(subject_ids), len(teacher_ids)
+    class_index = {cls: c for c, cls in enumerate(problem.classes)}
+    subject_index = {subject: s for s, subject in enumerate(subject_ids)}
+
+    # Periods per week wanted and daily limits, classes x subjects. 1 a day for subjects not asked for, like score.py
+    wanted = np.zeros((n_classes, n_subjects), dtype=np.int32)
+    limits = np.ones((n_classes, n_subjects), dtype=np.int32)
+    for cls, class_limits in score.daily_limits(problem).items():
+        for subject, limit in class_limits.items():
+            limits[class_index[cls], subject_index[subject]] = limit
+    for req in problem.requirements:
+        wanted[class_index[req.class_name], subject_index[req.subject]] = req.per_week
+    is_block = np.zeros(n_subjects + 1, dtype=bool) # The extra last entry is for -1, free periods
+    for subject in score.block_subjects(problem):
+        is_block[subject_index[subject]] = True
+
+    # Periods of each subject on each day, classes x days x subjects
+    by_day = subjects.reshape(n_classes, DAYS, PPD)
+    placed = by_day >= 0
+    cls_idx, day_idx, _ = np.nonzero(placed)
+    counts = np.zeros((n_classes, DAYS, n_subjects), dtype=np.int32)
+    np.add.at(counts, (cls_idx, day_idx, by_day[placed]), 1)
+
+    # Back to back periods of the same block subject, classes x days x subjects
+    pairs = (by_day[:, :, :-1] == by_day[:, :, 1:]) & placed[:, :, :-1] & is_block[by_day[:, :, :-1]]
+    cls_idx, day_idx, _ = np.nonzero(pairs)
+    adjacent = np.zeros((n_classes, DAYS, n_subjects), dtype=np.int32)
+    np.add.at(adjacent, (cls_idx, day_idx, by_day[:, :, :-1][pairs]), 1)
+
+    split = (counts == 2) & is_block[:n_subjects] & (adjacent == 0)
+    class_bunching = np.maximum(counts - limits[:, None, :], 0).sum(axis=(1, 2)) + split.sum(axis=(1, 2))
+
+    # Class teacher present on each day, classes x days
+    # -1 for classes without a class teacher, who count as present like in score.py
+    teacher_index = {teacher: t for t, teacher in enumerate(teacher_ids)}
+    teacher_index[None] = -1
+    ct = np.array([teacher_index.get(problem.class_teachers.get(cls), -2) for cls in problem.classes], dtype=np.int32).reshape(n_classes, 1, 1)
+    ct_present = (teachers.reshape(n_classes, DAYS, PPD) == ct).any(axis=2) | (ct[:, :, 0] == -1)
+    class_absent = DAYS - ct_present.sum(axis=1)
+
+    # Teachers x days x periods busy or not. From the Timetable's bitsets, which have the teachers of elective groups too
+    bitsets = np.array([tt.teacher_busy.get(teacher, 0) for teacher in teacher_ids], dtype=np.uint64).reshape(n_teachers, 1)
+    busy = ((bitsets >> np.arange(prob.SLOTS, dtype=np.uint64)) & np.uint64(1)).astype(bool)
+    busy = busy.reshape(n_teachers, DAYS, PPD)
+    load = busy.sum(axis=2)
+    first = busy.argmax(axis=2)
+    last = PPD - 1 - busy[:, :, ::-1].argmax(axis=2)
+    teacher_gaps = np.where(load > 0, last - first + 1 - load, 0).sum(axis=1)
+    teacher_peak = load.max(axis=1) if n_teachers else np.zeros(0, dtype=np.int32)
+
+    unassigned = int(np.maximum(wanted - counts.sum(axis=1), 0).sum())
+    parts = {"unassigned": unassigned, "bunching": int(class_bunching.sum()), "ct_absent": int(class_absent.sum()), "gaps": int(teacher_gaps.sum())}
+    return {
+        **parts,
+        "split_blocks": int(split.sum()),
+        "blocks": int(adjacent.sum()),
+        "peak_load": int(teacher_peak.max()) if n_teachers else 0,
+        "mean_peak": round(float(teacher_peak.mean()), 2) if n_teachers else 0.0,
+        "score": score.total(parts),
+        "per_class": {cls: {"bunching": int(class_bunching[c]), "ct_absent": int(class_absent[c])} for c, cls in enumerate(problem.classes)},
+        "per_teacher": {teacher: {"gaps": int(teacher_gaps[t]), "peak_load": int(teacher_peak[t])} for t, teacher in enumerate(teacher_ids)},
+    }
+
+# The measures of measure() without the per class and per teacher ones, for logging
+def summary(measures: dict):
+    return {key: value for key, value in measures.items() if key not in ("per_class", "per_teacher")}
@@ -0,0 +1,56 @@
+# Makes many timetables at once on all cores and keeps the best.
+#
+# Each attempt places the class-subject combinations in a different (seeded) order,
+# which is enough to give quite different timetables. Attempts are scored with
+# score.score() and only the seed of the best one is sent back; the winner is then
+# made again from its seed, so no timetables need to be passed between processes.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from utils import logmaster
+from utils import engine
+from utils import score
+from utils import problem as prob
+from utils import instrument
+from utils import progress
+
+_log = logmaster.getLogger()
+
+# The problem, set once in every worker process instead of being sent with every attempt
+_problem = None
+
+def _init_worker(problem: prob.Problem):
+    global _problem
+    _problem = problem
+    progress.listen(None) # Only the parent process reports, once per attempt
+
+# One attempt. Returns (total score, parts of the score, seed)
+def _attempt(seed: int):
+    tt, missing = engine.solve(_problem, seed)
+    total, parts = score.score(_problem, tt, len(missing))
+    return total, parts, seed
+
+# Makes `starts` timetables and returns the best, like engine.solve()
+#
+# @param starts  -- Number of timetables to make
+# @param workers -- Number of processes. All cores if None
+@instrument.timed
+def solve(problem: prob.Problem, starts: int, workers: int = None):
+    workers = workers or os.cpu_count()
+    _log.info("Making %s timetables on %s processes...", starts, workers)
+
+    best = None
+    with ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (problem,)) as pool:
+        try:
+            for done, result in enumerate(pool.map(_attempt, range(starts), chunksize = max(starts // (workers * 4), 1)), 1):
+                if best is None or result[0] < best[0]:
+                    best = result
+                progress.report("starting", done = done, starts = starts, best = best[0])
+        except progress.Cancelled:
+            # Don't wait for the attempts not started yet
+            pool.shutdown(cancel_futures = True)
+            raise
+
+    total, parts, seed = best
+    _log.info("Best of %s timetables: seed %s, score %s %s", starts, seed, total, parts)
+    return engine.solve(problem, seed)
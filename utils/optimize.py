@@ -0,0 +1,130 @@
+# Improves a finished timetable by simulated annealing.
+#
+# A move swaps two slots of one class (either may be empty), as long as neither
+# teacher ends up in two places at once. Moves that make the score (see score.py)
+# better are always kept; worse ones are kept now and then, less and less often as
+# the temperature falls, so the search doesn't get stuck early on.
+#
+# A move only changes the class's two days and the two teachers' two days, so only
+# those are scored again. The cost of every day of every class is kept, and a
+# teacher's day is scored from their bitset in a few operations.
+
+import math
+import random
+import time
+from utils import logmaster
+from utils import score
+from utils import problem as prob
+from utils import instrument
+from utils import progress
+from utils.engine import Timetable, CCA_SLOTS
+
+_log = logmaster.getLogger()
+
+# Slots that may be moved around. Not the CCA periods.
+MOVABLE_SLOTS = [slot for slot in range(prob.SLOTS) if slot not in CCA_SLOTS]
+
+# Improves the timetable in place.
+#
+# Returns the score (of score.score()) before and after
+#
+# @param tt          -- The engine.Timetable
+# @param moves       -- Number of moves to try
+# @param temperature -- Starting temperature. Roughly, how much worse a move may make
+#                       the score and still be kept at the start
+# @param seed        -- Seed for the random moves
+# @param time_limit  -- Stop after this many seconds even if not all moves are tried
+@instrument.timed
+def optimize(problem: prob.Problem, tt: Timetable, moves: int, temperature: float = 3.0, seed: int = 0, time_limit: float = None):
+    rng = random.Random(seed)
+    limits = score.daily_limits(problem)
+    blocks = score.block_subjects(problem)
+    w_bunching, w_absent, w_gaps = score.WEIGHTS["bunching"], score.WEIGHTS["ct_absent"], score.WEIGHTS["gaps"]
+    ppd = prob.PERIODS_PER_DAY
+
+    # Weighted cost of each day of each class
+    def day_cost(cls, cells):
+        bunching, ct_absent = score.class_day_cost(cells, problem.class_teachers.get(cls), limits[cls], blocks)
+        return w_bunching * bunching + w_absent * ct_absent
+
+    day_costs = {cls: [day_cost(cls, row[day * ppd:(day + 1) * ppd]) for day in range(len(prob.DAYS))] for cls, row in tt.cells.items()}
+    classes = list(tt.cells)
+    gaps = score.teacher_day_gaps
+
+    before, _ = score.score(problem, tt, 0)
+    current = before
+    accepted = 0
+    # Cool down geometrically to a hundredth of the starting temperature
+    cooling = 0.01 ** (1 / max(moves, 1))
+    deadline = time.monotonic() + time_limit if time_limit else None
+
+    for move in range(moves):
+        if move % 10000 == 0:
+            if deadline and time.monotonic() > deadline:
+                _log.info("Ran out of time after %s moves.", move)
+                break
+            progress.report("optimizing", done = move, moves = moves, score = current)
+        temperature *= cooling
+
+        cls = classes[rng.randrange(len(classes))]
+        a = MOVABLE_SLOTS[rng.randrange(len(MOVABLE_SLOTS))]
+        b = MOVABLE_SLOTS[rng.randrange(len(MOVABLE_SLOTS))]
+        row = tt.cells[cls]
+        cell_a, cell_b = row[a], row[b]
+        if a == b or cell_a == cell_b:
+            continue
+
+        # Neither teacher may be busy elsewhere in the slot they move to
+        teacher_a = cell_a[1] if cell_a else None
+        teacher_b = cell_b[1] if cell_b else None
+        if teacher_a != teacher_b:
+            if teacher_a is not None and not tt.teacher_free(teacher_a, b):
+                continue
+            if teacher_b is not None and not tt.teacher_free(teacher_b, a):
+                continue
+
+        # Score only what changes
+        day_a, day_b = a // ppd, b // ppd
+        days = (day_a,) if day_a == day_b else (day_a, day_b)
+        delta = 0
+        new_costs = []
+        for day in days:
+            cells = row[day * ppd:(day + 1) * ppd]
+            if day == day_a:
+                cells[a - day * ppd] = cell_b
+            if day == day_b:
+                cells[b - day * ppd] = cell_a
+            cost = day_cost(cls, cells)
+            new_costs.append(cost)
+            delta += cost - day_costs[cls][day]
+
+        if teacher_a != teacher_b:
+            for teacher, old_slot, new_slot in ((teacher_a, a, b), (teacher_b, b, a)):
+                if teacher is None:
+                    continue
+                for member in prob.members(teacher): # Each teacher of an elective group
+                    busy = tt.teacher_busy[member]
+                    moved = busy & ~(1 << old_slot) | (1 << new_slot)
+                    for day in days:
+                        delta += w_gaps * (gaps(moved, day) - gaps(busy, day))
+
+        if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+            continue
+
+        # Keep the move
+        tt.remove(cls, a)
+        tt.remove(cls, b)
+        if cell_a:
+            tt.place(cls, b, *cell_a)
+        if cell_b:
+            tt.place(cls, a, *cell_b)
+        for day, cost in zip(days, new_costs):
+            day_costs[cls][day] = cost
+        current += delta
+        accepted += 1
+
+    after, parts = score.score(problem, tt, 0)
+    if after != current:
+        _log.warning("Kept score %s differs from the actual score %s.", current, after)
+    _log.info("Optimized timetable: score %s -> %s %s after %s moves, %s kept.", before, after, parts, moves, accepted)
+    return before, after
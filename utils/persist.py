@@ -0,0 +1,96 @@
+# Write-behind persistence for table `timetable`.
+#
+# Rather than executing (and committing) one statement per period, the writes
+# are collected and sent in batches with executemany(), which mysql.connector
+# turns into multi-row INSERTs. Everything goes in one transaction: either the
+# whole timetable is saved or, if something fails, none of it is.
+#
+# Usage:
+#
+#     with persist.TimetableWriter(sql_conn) as writer:
+#         writer.insert("6A", "MAT", "AB", 3)
+#         writer.flush()    # Only needed before reading back from `timetable`
+#     # Committed here, or rolled back if an exception was raised
+
+from utils import logmaster
+
+_log = logmaster.getLogger()
+
+_INSERT = "INSERT INTO timetable VALUES (%s, %s, %s, %s);"
+_UPDATE = "UPDATE timetable SET subject = %s, teacher = %s WHERE class = %s AND period = %s;"
+_DELETE = "DELETE FROM timetable WHERE class = %s AND period = %s;"
+_CLEAR = "DELETE FROM timetable;"
+
+class TimetableWriter:
+    # @param sql_conn   -- The database connection
+    # @param batch_size -- Flush automatically once this many writes are pending
+    def __init__(self, sql_conn, batch_size: int = 1000):
+        self.sql_conn = sql_conn
+        self.batch_size = batch_size
+        self.cursor = sql_conn.cursor()
+        self.pending = [] # List of (statement, params) in the order they were made
+        self.written = 0  # Number of writes sent to the database but not committed yet
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                try:
+                    self.commit()
+                except:
+                    # The last writes are only sent on commit. If they fail, the earlier ones mustn't stay
+                    self.rollback()
+                    raise
+            else:
+                self.rollback()
+        finally:
+            self.cursor.close()
+        return False # Don't swallow the exception
+
+    def _queue(self, statement: str, params):
+        self.pending.append((statement, params))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    # Adds a period to the timetable
+    def insert(self, class_name: str, subject: str, teacher: str, period: int):
+        self._queue(_INSERT, (class_name, subject, teacher, period))
+
+    # Changes the subject and teacher of an already assigned period
+    def update(self, class_name: str, period: int, subject: str, teacher: str):
+        self._queue(_UPDATE, (subject, teacher, class_name, period))
+
+    # Empties a period
+    def delete(self, class_name: str, period: int):
+        self._queue(_DELETE, (class_name, period))
+
+    # Empties the whole timetable. Nothing is lost until the commit, unlike dropping the table
+    def clear(self):
+        self._queue(_CLEAR, ())
+
+    # Sends all the pending writes to the database, without committing.
+    # Reads on the same connection will see them after this.
+    def flush(self):
+        # Consecutive writes of the same statement go together, so the order is kept
+        start = 0
+        for i in range(1, len(self.pending) + 1):
+            if i == len(self.pending) or self.pending[i][0] != self.pending[start][0]:
+                self.cursor.executemany(self.pending[start][0], [params for _, params in self.pending[start:i]])
+                start = i
+        self.written += len(self.pending)
+        self.pending = []
+
+    def commit(self):
+        self.flush()
+        self.sql_conn.commit()
+        _log.info("Committed %s timetable writes.", self.written)
+        self.written = 0
+
+    # Throws away everything since the last commit, pending or not
+    def rollback(self):
+        _log.warning("Rolling back %s timetable writes.", self.written + len(self.pending))
+        self.pending = []
+        self.sql_conn.rollback()
+        self.written = 0
@@ -1,97 +1,107 @@
 from utils import connect
 from utils import logmaster
+from utils import instrument
+from utils import snapshot
+from utils import problem as prob
 import csv
 
 _log = logmaster.getLogger()
 
-# Connect to MySQL
-sql_conn = connect.connect_to_db()
-cursor = sql_conn.cursor()
+# The shared connection. Connects on first use.
+sql_conn = connect.shared
+cursor = connect.LazyCursor()
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+
+# Writes one class's or teacher's timetable
+#
+# @param writer -- csv writer of the file
+# @param title  -- Row above the timetable
+# @param grid   -- List of 48 cells, in the order of slots (see problem.slot_of())
+# @param end    -- Row after the timetable
+def _write_grid(writer, title: str, grid: list, end: list):
+    writer.writerow([title])
+    writer.writerow(["Day", "1", "2", "3", "4", "5", "6", "7", "8"])
+    for i, day in enumerate(DAYS):
+        writer.writerow([day] + grid[i * prob.PERIODS_PER_DAY:(i + 1) * prob.PERIODS_PER_DAY])
+    writer.writerow(end)
+
+# Saves class and teacher timetables in a readable format, reading table `timetable` just once.
+# Can also save a snapshot of them for programs to read. See snapshot.py
+#
+# The rows come sorted by class, so each class is written as soon as its rows are read.
+# Teachers' periods are spread over all classes, so their timetables (just the class in
+# each of the 48 slots) are kept until the end, then written sorted by teacher.
+#
+# @param classes_file  -- Path to the csv file for class timetables. Not written if None
+# @param teachers_file -- Path to the csv file for teacher timetables. Not written if None
+# @param snapshot_file -- Path to the snapshot. Not written if None
+@instrument.timed
+def export(classes_file: str = None, teachers_file: str = None, snapshot_file: str = None):
+    _log.info("Writing timetables to file...")
+    teachers = {}
+    class_file = open(classes_file, "w") if classes_file else None
+    snap = snapshot.Writer(snapshot_file) if snapshot_file else None
+    try:
+        class_writer = csv.writer(class_file, delimiter=',') if class_file else None
+
+        # Writes out a class once all its rows are read
+        def finish(class_name, cells):
+            if class_writer:
+                _write_grid(class_writer, f"---Class {class_name}---", [f"{cell[0]} ({cell[1]})" if cell else "" for cell in cells], ["\n"])
+            if snap:
+                snap.add_class(class_name, cells)
+
+        current, cells = None, None
+        # Streamed, not fetched all at once
+        cursor.execute("""
+            SELECT timetable.class, timetable.subject, timetable.teacher, periods.day, periods.period
+            FROM timetable JOIN periods ON periods.ID = timetable.period
+            ORDER BY timetable.class;
+        """)
+        for class_name, subject, teacher, day, period in cursor:
+            slot = prob.slot_of(day, period)
+            if class_name != current:
+                if current is not None:
+                    finish(current, cells)
+                current, cells = class_name, [None] * prob.SLOTS
+            # More than one row in a period is an elective group
+            cells[slot] = (subject, teacher) if cells[slot] is None else prob.group([cells[slot], (subject, teacher)])
+            if teachers_file and teacher is not None:
+                teachers.setdefault(teacher, [""] * prob.SLOTS)[slot] = class_name
+
+        if current is not None:
+            finish(current, cells)
+    except BaseException:
+        if snap:
+            snap.discard()
+        raise
+    else:
+        if snap:
+            snap.close()
+    finally:
+        if class_file:
+            class_file.close()
+    if classes_file:
+        _log.info(f"Class timetables successfully written to {classes_file}.")
+    if snapshot_file:
+        _log.info(f"Timetable snapshot successfully written to {snapshot_file}.")
+
+    if teachers_file:
+        with open(teachers_file, "w", newline="") as tt_file:
+            csv_writer = csv.writer(tt_file)
+            for teacher in sorted(teachers):
+                _write_grid(csv_writer, f"——— {teacher} ———", teachers[teacher], [])
+        _log.info(f"Teachers' timetables successfully written to {teachers_file}.")
 
 # Save all the class timetables to a single csv file in a readable format
 #
-# @param file_path -- Path to the csv file to which the timetable is to be saved 
+# @param file_path -- Path to the csv file to which the timetable is to be saved
 def class_timetables(file_path):
-    _log.info("Writing class timetables to file...")
-    # Get a list of all classes
-    cursor.execute("SELECT DISTINCT class FROM timetable ORDER BY class;")
-    classes = [i[0] for i in cursor.fetchall()]
-
-    with open(file_path, "w") as file:
-        writer = csv.writer(file, delimiter=',')
-
-        days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
-
-        # Header and column names
-        for cls in classes:
-            writer.writerow([f"---Class {cls}---"])
-            writer.writerow(["Day", "1", "2", "3", "4", "5", "6", "7", "8"])
-
-            # Get the timetable entries
-            cursor.execute("SELECT subject, teacher, period FROM timetable WHERE class = %s;", [cls])
-
-            data = cursor.fetchall()
-
-            # Create empty timetable
-            timetable = {day: [""] * 8 for day in days}
-
-            # Fill timetable
-            for subject, teacher, period in data:
-                day_num = (period - 1) // 8
-                period_num = (period - 1) % 8
-                day = days[day_num]
-                timetable[day][period_num] = f"{subject} ({teacher})"
-
-            for day in days:
-                writer.writerow([day] + timetable[day])
-
-            # Add a blank row after every class's timetable
-            writer.writerow(["\n"])
-    _log.info(f"Class timetables successfully written to {file_path}.")
+    export(classes_file = file_path)
 
 # Save all the teachers timetables to a single csv file in a readable format
 #
-# @param file_path -- Path to the csv file to which the timetable is to be saved 
+# @param file_path -- Path to the csv file to which the timetable is to be saved
 def teachers_timetables(file_path):
-    _log.info("Writing teacher timetables to file...")
-    # Get all teachers and their subjects
-    cursor.execute("SELECT DISTINCT teacher FROM timetable ORDER BY teacher;")
-    teachers = cursor.fetchall()
-
-    days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
-
-    with open(file_path, "w", newline="") as tt_file:
-        csv_writer = csv.writer(tt_file)
-
-        for teacher_name in teachers:
-            teacher_name = teacher_name[0]
-            # Header for the teacher
-            csv_writer.writerow([f"——— {teacher_name} ———"])
-            csv_writer.writerow(["Day", "1", "2", "3", "4", "5", "6", "7", "8"])
-
-            # Get the teacher’s timetable entries
-            cursor.execute("""
-                SELECT class, period
-                FROM timetable
-                WHERE teacher = %s;
-            """, [teacher_name])
-            tt_data = cursor.fetchall()
-
-            # Create empty timetable
-            timetable = {day: [""] * 8 for day in days}
-
-            # Fill timetable
-            for class_name, period_id in tt_data:
-                day_index = (period_id - 1) // 8  # 0–5 (Mon–Sat)
-                period_num = (period_id - 1) % 8  # 0–7 (Period 1–8)
-                day = days[day_index]
-                timetable[day][period_num] = class_name  # Just class name now
-
-            # Write rows
-            for day in days:
-                csv_writer.writerow([day] + timetable[day])
-
-            # Add a blank row after each teacher’s timetable
-            csv_writer.writerow([])
-          
-    _log.info(f"Teachers' timetables successfully written to {file_path}.")
+    export(teachers_file = file_path)
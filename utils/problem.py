@@ -0,0 +1,222 @@
+from collections import namedtuple
+import glob
+import os
+import pickle
+import re
+import uuid
+from utils import logmaster
+from utils import instrument
+from utils import connect
+
+_log = logmaster.getLogger()
+
+# The days of the week in the order they appear in table `periods`
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat")
+PERIODS_PER_DAY = 8
+SLOTS = len(DAYS) * PERIODS_PER_DAY
+
+# One class-subject combination to be scheduled
+#
+# @field class_name       -- ID of class
+# @field subject          -- ID of subject, or the subjects of an elective group (see below)
+# @field teacher          -- ID of teacher (may be None if nobody could be assigned), or the teachers of an elective group
+# @field per_week         -- Number of periods of this subject in a week
+# @field intensity        -- "block" or "single"
+# @field is_class_teacher -- Whether `teacher` is the class teacher of `class_name`
+Requirement = namedtuple("Requirement", ["class_name", "subject", "teacher", "per_week", "intensity", "is_class_teacher"])
+
+# Everything needed to make a timetable, loaded from the database in one go
+#
+# @field period_ids      -- Tuple of period IDs indexed by slot (0 to 47)
+# @field classes         -- Tuple of class IDs
+# @field class_teachers  -- Dictionary of class -> class teacher
+# @field requirements    -- Tuple of `Requirement`, class teachers' appearing first
+# @field teacher_subject -- Dictionary of teacher -> subject taught
+Problem = namedtuple("Problem", ["period_ids", "classes", "class_teachers", "requirements", "teacher_subject"])
+
+# ----------- ELECTIVE GROUPS -----------
+#
+# An elective group is a few subjects a class splits up for, Eg: SAN/FRE, half the class
+# learning each. They are taught at the same time, each by its own teacher, so the group
+# takes up a single slot of the class like any other subject, and books all its teachers.
+#
+# A group goes wherever a subject would, as its subjects joined by GROUP_SEPARATOR, sorted,
+# and their teachers joined the same way, in the same order. Eg: ("FRE/SAN", "T07/T03").
+# Requirements, Timetable cells and the like need nothing else to hold one; whatever
+# deals with single teachers splits them with members(). In table `timetable`, a group
+# is a row for each subject, all in the same period.
+
+GROUP_SEPARATOR = "/"
+
+# The subjects or teachers of an elective group. A list of just the one for anything else
+def members(value: str):
+    return value.split(GROUP_SEPARATOR) if value is not None else [None]
+
+def is_group(value: str):
+    return value is not None and GROUP_SEPARATOR in value
+
+# Puts (subject, teacher) pairs together into the (subject, teacher) of one elective group.
+# Pairs that are groups themselves are taken apart first. A single pair is returned as it is.
+def group(cells):
+    if len(cells) == 1:
+        return cells[0]
+    pairs = sorted(pair for subject, teacher in cells for pair in zip(members(subject), members(teacher)))
+    return GROUP_SEPARATOR.join(subject for subject, _ in pairs), GROUP_SEPARATOR.join(teacher or "" for _, teacher in pairs)
+
+# The subject a teacher teaches in a (subject, teacher) cell; one of the subjects for an elective group
+def subject_of(cell, teacher: str):
+    subjects, teachers = members(cell[0]), members(cell[1])
+    return subjects[teachers.index(teacher)] if teacher in teachers else cell[0]
+
+# Returns the slot (0 to 47) of a day and period number
+#
+# @param day    -- day Eg: "mon", "tue" ...
+# @param period -- period number Eg: 1, 2, 3, 4 ...
+def slot_of(day: str, period: int):
+    return DAYS.index(day) * PERIODS_PER_DAY + period - 1
+
+# A class ID: the campus (for schools having more than one), the grade and the section.
+# Eg: 6A, 10C, N12AB, C2-9F
+_CLASS_ID = re.compile(r"(.*?)(\d+)(\D*)")
+
+# Splits a class ID into (campus, grade, section). Like ("", 10, "C") for 10C, ("N", 12, "AB") for N12AB
+# Raises ValueError if it has no grade
+def parse_class(class_name: str):
+    match = _CLASS_ID.fullmatch(class_name)
+    if match is None:
+        raise ValueError(f"Class '{class_name}' has no grade. Expected [CAMPUS]GRADE[SECTION], like 10C.")
+    return match.group(1), int(match.group(2)), match.group(3)
+
+# Returns the grade of a class. Like 6 for 6A, 10 for 10C
+# Where the database is at hand, the grade in table `classes` is the one to use.
+def grade_of(class_name: str):
+    return parse_class(class_name)[1]
+
+# ----------- CACHE -----------
+#
+# The problem only changes when the tables it is made from do, so the last one loaded is
+# kept on disk and loaded from there while they stay the same.
+#
+# Whatever changes those tables (db.update_db(), assigning teachers, class teachers,
+# reschedule) calls inputs_changed(), which puts a new random token in table `problem_inputs`.
+# The cache file is named after it, so a single one-row query tells whether it still holds.
+# Changes made to the tables by hand aren't noticed; run with --no-cache after those.
+
+# Where the problem is cached. Not cached if None
+CACHE_DIR = ".cache"
+
+# Marks the tables the problem is made from as changed. Doesn't commit, so it goes with the changes.
+# Databases loaded before there was a cache have no `problem_inputs`; nothing is cached for them.
+#
+# @param cursor -- A cursor to write with
+def inputs_changed(cursor):
+    try:
+        cursor.execute("DELETE FROM problem_inputs;")
+        cursor.execute("INSERT INTO problem_inputs VALUES (%s);", [uuid.uuid4().hex])
+    except connect.Error:
+        pass
+
+# Path of the cache file of the tables as they are now, or None if they can't be told apart
+def _cache_file(cursor):
+    try:
+        cursor.execute("SELECT token FROM problem_inputs;")
+        rows = cursor.fetchall()
+    except connect.Error: # Not made yet
+        return None
+    return os.path.join(CACHE_DIR, f"problem-{rows[0][0]}.pickle") if rows else None
+
+# Loads the problem, from the cache if the tables haven't changed since it was saved
+#
+# @param cursor -- A cursor to read from
+@instrument.timed
+def load_problem(cursor):
+    cache_file = _cache_file(cursor) if CACHE_DIR else None
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as file:
+                problem = pickle.load(file)
+            _log.info("Loaded timetable problem from %s.", cache_file)
+            return problem
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as err:
+            _log.warning("Couldn't read cached problem %s: %s", cache_file, err)
+
+    problem = _load_problem(cursor)
+    if cache_file:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Older problems won't be loaded again
+            for old in glob.glob(os.path.join(CACHE_DIR, "problem-*.pickle")):
+                os.remove(old)
+            with open(cache_file + ".tmp", "wb") as file:
+                pickle.dump(problem, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_file + ".tmp", cache_file)
+        except OSError as err:
+            _log.warning("Couldn't cache problem to %s: %s", cache_file, err)
+    return problem
+
+# Loads the problem with a handful of queries instead of one per slot
+#
+# @param cursor -- A cursor to read from
+def _load_problem(cursor):
+    _log.info("Loading timetable problem from database...")
+
+    cursor.execute("SELECT ID, day, period FROM periods;")
+    period_ids = [None] * SLOTS
+    for period_id, day, period in cursor.fetchall():
+        period_ids[slot_of(day, period)] = period_id
+
+    cursor.execute("SELECT ID, grade, teacher FROM classes ORDER BY campus, grade, section;")
+    class_teachers = {}
+    grades = {}
+    for cls, grade, teacher in cursor.fetchall():
+        class_teachers[cls] = teacher
+        grades[cls] = grade
+
+    cursor.execute("SELECT ID, intensity FROM subjects;")
+    intensity = {subject: value for subject, value in cursor.fetchall()}
+
+    cursor.execute("SELECT grade, subject, per_week FROM periods_per_week;")
+    per_week = {(grade, subject): value for grade, subject, value in cursor.fetchall()}
+
+    cursor.execute("SELECT ID, subject FROM teachers;")
+    teacher_subject = {teacher: subject for teacher, subject in cursor.fetchall()}
+
+    cursor.execute("SELECT class, subject, teacher, elective_group FROM subject_teachers;")
+    requirements = []
+    groups = {} # (class, elective group) -> list of Requirement, put together below
+    for class_name, subject, teacher, elective_group in cursor.fetchall():
+        grade = grades.get(class_name)
+        if (grade, subject) not in per_week:
+            _log.error("No periods per week found for grade %s subject %s.", grade, subject)
+            continue
+        req = Requirement(
+            class_name, subject, teacher,
+            per_week[(grade, subject)] or 0,
+            intensity.get(subject, "single"),
+            teacher is not None and class_teachers.get(class_name) == teacher
+        )
+        if elective_group is None:
+            requirements.append(req)
+        elif teacher is None:
+            _log.error("No teacher for %s of elective group %s of class %s. Leaving it out.", subject, elective_group, class_name)
+        else:
+            groups.setdefault((class_name, elective_group), []).append(req)
+
+    # The group has as many periods as the subject having the most, and block periods if all its subjects do
+    for (class_name, elective_group), reqs in groups.items():
+        subject, teacher = group([(req.subject, req.teacher) for req in reqs])
+        if len({req.per_week for req in reqs}) > 1:
+            _log.warning("Subjects of elective group %s of class %s have different periods per week. Giving all %s.",
+                         elective_group, class_name, max(req.per_week for req in reqs))
+        requirements.append(Requirement(
+            class_name, subject, teacher,
+            max(req.per_week for req in reqs),
+            "block" if all(req.intensity == "block" for req in reqs) else "single",
+            len(reqs) == 1 and reqs[0].is_class_teacher
+        ))
+
+    # Class teachers first. See create_timetable() in main.py for why.
+    requirements.sort(key = lambda r: not r.is_class_teacher)
+
+    _log.info("Loaded %s classes and %s class-subject combinations.", len(class_teachers), len(requirements))
+    return Problem(tuple(period_ids), tuple(class_teachers), class_teachers, tuple(requirements), teacher_subject)
@@ -0,0 +1,47 @@
+# Progress of a long run, for whoever is watching it (the GUI, see gui.py), and a way to stop it.
+#
+# The engine calls report() as it goes. Eg:
+#
+#     progress.report("placing", requirements_done=10, requirements=400, classes_done=1, classes=52, placed=60, unassigned=0)
+#
+# and every report is handed to the listener, if there is one, as (event, fields). The listener is
+# called in the thread doing the work, so it should only pass the report on. Eg: into a queue.
+#
+# report() is also where a run stops once cancel() is called: it raises Cancelled, which
+# unwinds the run like any other error. Nothing is written to the database until a timetable
+# is complete (see generate_timetable() in main.py), and persist.TimetableWriter rolls back
+# if anything fails while it is, so a cancelled run leaves the old timetable as it was.
+
+import threading
+
+class Cancelled(Exception):
+    pass
+
+_listener = None
+_cancel = threading.Event()
+
+# Sets the function called with every report. None for no one
+def listen(listener):
+    global _listener
+    _listener = listener
+
+# Reports how far along a run is. Raises Cancelled if the run was cancelled.
+#
+# @param event  -- What is going on. Eg: "placing", "repairing", "saving"
+# @param fields -- Numbers that go with it
+def report(event: str, **fields):
+    if _cancel.is_set():
+        raise Cancelled(f"Cancelled while {event}.")
+    if _listener is not None:
+        _listener(event, fields)
+
+# Asks the run to stop at its next report(). May be called from any thread.
+def cancel():
+    _cancel.set()
+
+# Clears a cancel(), before starting another run
+def reset():
+    _cancel.clear()
+
+def cancelled():
+    return _cancel.is_set()
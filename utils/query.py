@@ -0,0 +1,89 @@
+# Answers "who is free when" questions about the saved timetable without scanning it.
+#
+# The timetable is loaded once and indexed by slot (see problem.slot_of()):
+#   free_teachers -- slot -> set of teachers with no period then
+#   busy_classes  -- slot -> {class: (subject, teacher)}
+#   free_classes  -- slot -> set of classes with no period then
+# and by teacher, through the engine.Timetable's teacher_cells (teacher -> {slot: class}).
+# Every lookup is then a dictionary or list access. Changes made through place() and
+# remove() keep the indexes up to date; call rebuild() after changing the Timetable directly.
+
+from utils import engine
+from utils import problem as prob
+from utils import instrument
+
+class Index:
+    def __init__(self, problem: prob.Problem, tt: engine.Timetable):
+        self.problem = problem
+        self.tt = tt
+        self.rebuild()
+
+    # Builds the indexes again from the timetable
+    def rebuild(self):
+        teachers = set(self.problem.teacher_subject)
+        self.free_teachers = [set(teachers) for _ in range(prob.SLOTS)]
+        self.busy_classes = [{} for _ in range(prob.SLOTS)]
+        self.free_classes = [set(self.tt.cells) for _ in range(prob.SLOTS)]
+        for cls, row in self.tt.cells.items():
+            for slot, cell in enumerate(row):
+                if cell is not None:
+                    self.busy_classes[slot][cls] = cell
+                    self.free_classes[slot].discard(cls)
+                    self.free_teachers[slot].difference_update(prob.members(cell[1]))
+
+    def place(self, class_name: str, slot: int, subject: str, teacher: str):
+        self.tt.place(class_name, slot, subject, teacher)
+        self.busy_classes[slot][class_name] = (subject, teacher)
+        self.free_classes[slot].discard(class_name)
+        self.free_teachers[slot].difference_update(prob.members(teacher))
+
+    def remove(self, class_name: str, slot: int):
+        cell = self.tt.remove(class_name, slot)
+        if cell is not None:
+            del self.busy_classes[slot][class_name]
+            self.free_classes[slot].add(class_name)
+            self.free_teachers[slot].update(teacher for teacher in prob.members(cell[1]) if teacher in self.problem.teacher_subject)
+        return cell
+
+    # Teachers with no period at a time, sorted
+    #
+    # @param day    -- day Eg: "mon", "tue" ...
+    # @param period -- period number Eg: 1, 2, 3, 4 ...
+    def free_teachers_at(self, day: str, period: int):
+        return sorted(self.free_teachers[prob.slot_of(day, period)])
+
+    # Classes having a period at a time
+    #
+    # Returns a dictionary of class -> (subject, teacher)
+    def busy_classes_at(self, day: str, period: int):
+        return dict(self.busy_classes[prob.slot_of(day, period)])
+
+    # Classes with no period at a time, sorted
+    def free_classes_at(self, day: str, period: int):
+        return sorted(self.free_classes[prob.slot_of(day, period)])
+
+    # The periods of a teacher
+    #
+    # Returns a list of (day, period, class) in the order of the week
+    def teacher_periods(self, teacher: str):
+        cells = self.tt.teacher_cells.get(teacher, {})
+        return [(prob.DAYS[slot // prob.PERIODS_PER_DAY], slot % prob.PERIODS_PER_DAY + 1, cells[slot]) for slot in sorted(cells)]
+
+    # The other classes free whenever a class is free
+    #
+    # Returns a list of (day, period, [classes]) for every free period of the class
+    def free_with(self, class_name: str):
+        free = []
+        for slot in range(prob.SLOTS):
+            if class_name in self.free_classes[slot]:
+                others = sorted(self.free_classes[slot] - {class_name})
+                free.append((prob.DAYS[slot // prob.PERIODS_PER_DAY], slot % prob.PERIODS_PER_DAY + 1, others))
+        return free
+
+# Loads the saved timetable and indexes it
+#
+# @param cursor -- A cursor to read from
+@instrument.timed
+def load(cursor):
+    problem = prob.load_problem(cursor)
+    return Index(problem, engine.load_timetable(cursor, problem))
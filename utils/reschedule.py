@@ -0,0 +1,158 @@
+# Updates the saved timetable after a change, instead of making a new one.
+#
+# Mid-term changes -- a teacher replaced for a class, a subject getting more or fewer
+# periods a week, a teacher leaving -- only affect a few periods. Those are unassigned
+# and placed again with engine.repair(), which swaps as few other periods as it can.
+# Everything else stays as it was, so the published timetable barely changes.
+#
+# reschedule() also works when the data was changed some other way (Eg: by hand in SQL).
+# It brings the timetable in line with whatever is in the database now.
+
+from utils import logmaster
+from utils import engine
+from utils import persist
+from utils import problem as prob
+from utils import instrument
+
+_log = logmaster.getLogger()
+
+# Unassigns whatever doesn't match the problem anymore, keeping everything else.
+# Where a period's teacher changed and the new one is free then, the period just
+# changes hands.
+#
+# Returns the periods to be placed, like engine.find_missing()
+def unassign_changed(problem: prob.Problem, tt: engine.Timetable):
+    teachers = {(req.class_name, req.subject): req.teacher for req in problem.requirements}
+
+    for cls, row in tt.cells.items():
+        # CCA is always with the class teacher, who may have changed
+        for slot in engine.CCA_SLOTS:
+            if row[slot] != ("CCA", problem.class_teachers[cls]):
+                tt.remove(cls, slot)
+                tt.place(cls, slot, "CCA", problem.class_teachers[cls])
+
+        for slot, cell in enumerate(row):
+            if cell is None or slot in engine.CCA_SLOTS:
+                continue
+            subject, teacher = cell
+            if (cls, subject) not in teachers: # Subject dropped
+                tt.remove(cls, slot)
+            elif teacher != teachers[(cls, subject)]:
+                tt.remove(cls, slot)
+                if tt.teacher_free(teachers[(cls, subject)], slot):
+                    tt.place(cls, slot, subject, teachers[(cls, subject)])
+
+        # Too many periods of a subject: drop them from the days having the most of it
+        for req in problem.requirements:
+            if req.class_name != cls or req.subject == "CCA":
+                continue
+            subject, wanted = req.subject, req.per_week
+            while tt.count(cls, subject) > wanted:
+                slots = [slot for slot, cell in enumerate(row) if cell and cell[0] == subject and slot not in engine.CCA_SLOTS]
+                per_day = {}
+                for slot in slots:
+                    per_day[slot // prob.PERIODS_PER_DAY] = per_day.get(slot // prob.PERIODS_PER_DAY, 0) + 1
+                tt.remove(cls, max(slots, key = lambda slot: (per_day[slot // prob.PERIODS_PER_DAY], slot)))
+
+    return engine.find_missing(problem, tt)
+
+# Picks who takes over the classes of a teacher who is leaving: for each class, the teacher
+# of the same subject who is free in most of the periods, and then, has the fewest periods.
+#
+# Returns a list of (class, subject, new teacher)
+#
+# @param teacher -- ID of the teacher leaving
+# @param leaving -- IDs of all teachers leaving, who can't take over
+def pick_replacements(problem: prob.Problem, tt: engine.Timetable, teacher: str, leaving: set):
+    subject = problem.teacher_subject.get(teacher)
+    candidates = [t for t, s in problem.teacher_subject.items() if s == subject and t not in leaving]
+    load = {t: bin(tt.teacher_busy.get(t, 0)).count("1") for t in candidates}
+
+    replacements = []
+    for req in problem.requirements:
+        if teacher not in prob.members(req.teacher):
+            continue
+        # In an elective group, just the teacher's own subject
+        taught = prob.subject_of((req.subject, req.teacher), teacher)
+        if not candidates:
+            _log.error("Nobody else teaches %s to take over %s from %s.", taught, req.class_name, teacher)
+            continue
+
+        slots = [slot for slot, cell in enumerate(tt.cells[req.class_name]) if cell == (req.subject, req.teacher)]
+        chosen = min(candidates, key = lambda t: (sum(not tt.teacher_free(t, slot) for slot in slots), load[t]))
+        load[chosen] += req.per_week
+        replacements.append((req.class_name, taught, chosen))
+
+    if teacher in problem.class_teachers.values():
+        _log.warning("%s is a class teacher. Assign a new class teacher for their class.", teacher)
+    return replacements
+
+# Checks that the changes are to things that exist, before any of them is made.
+# Raises ValueError naming the first one that doesn't
+#
+# @param cursor -- A cursor to read with
+# See reschedule() for the rest
+def check_changes(cursor, replacements, per_week, leaving):
+    cursor.execute("SELECT ID FROM teachers;")
+    teachers = {teacher for teacher, in cursor.fetchall()}
+    for teacher in leaving:
+        if teacher not in teachers:
+            raise ValueError(f"No teacher {teacher}.")
+
+    for class_name, subject, teacher in replacements:
+        if teacher not in teachers:
+            raise ValueError(f"No teacher {teacher} to teach {subject} to {class_name}.")
+        cursor.execute("SELECT COUNT(*) FROM subject_teachers WHERE class = %s AND subject = %s;", [class_name, subject])
+        if not cursor.fetchall()[0][0]:
+            raise ValueError(f"Class {class_name} doesn't take {subject}, or there is no class {class_name}.")
+
+    for grade, subject, periods in per_week:
+        cursor.execute("SELECT COUNT(*) FROM periods_per_week WHERE grade = %s AND subject = %s;", [grade, subject])
+        if not cursor.fetchall()[0][0]:
+            raise ValueError(f"Grade {grade} doesn't have {subject}, or there is no grade {grade}.")
+
+# Applies the changes to the database and updates the timetable to match.
+# All of it is a single transaction.
+# Raises ValueError, changing nothing, if a class, subject, grade or teacher doesn't exist
+#
+# Returns (the number of periods of the timetable that changed, the periods that couldn't be
+# placed again as a list of (class, subject, teacher))
+#
+# @param sql_conn     -- The database connection
+# @param replacements -- List of (class, subject, new teacher)
+# @param per_week     -- List of (grade, subject, periods per week)
+# @param leaving      -- List of IDs of teachers leaving
+@instrument.timed
+def reschedule(sql_conn, replacements: list = (), per_week: list = (), leaving: list = ()):
+    with persist.TimetableWriter(sql_conn) as writer:
+        cursor = sql_conn.cursor(buffered=True)
+        check_changes(cursor, replacements, per_week, leaving)
+        problem = prob.load_problem(cursor)
+        tt = engine.load_timetable(cursor, problem)
+        before = tt.copy_cells()
+
+        replacements = list(replacements)
+        for teacher in leaving:
+            replacements += pick_replacements(problem, tt, teacher, set(leaving))
+
+        for class_name, subject, teacher in replacements:
+            _log.info("%s now teaches %s to %s.", teacher, subject, class_name)
+            cursor.execute("UPDATE subject_teachers SET teacher = %s WHERE class = %s AND subject = %s;", [teacher, class_name, subject])
+        for grade, subject, periods in per_week:
+            _log.info("Grade %s now has %s periods of %s a week.", grade, periods, subject)
+            cursor.execute("UPDATE periods_per_week SET per_week = %s WHERE grade = %s AND subject = %s;", [periods, grade, subject])
+
+        # Reload with the changes made
+        prob.inputs_changed(cursor)
+        problem = prob.load_problem(cursor)
+        cursor.close()
+
+        missing = unassign_changed(problem, tt)
+        _log.info("%s periods to place again.", len(missing))
+        still_missing = engine.repair(tt, missing)
+        for cls, subject, teacher in still_missing:
+            _log.error("Could not assign a period of class %s subject %s taught by %s.", cls, subject, teacher)
+
+        changes = engine.write_changes(writer, problem, before, tt)
+        _log.info("Rescheduled: %s periods changed.", changes)
+    return changes, still_missing
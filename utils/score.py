@@ -0,0 +1,108 @@
+# Scores how good a timetable is. Lower is better.
+#
+# The score is a weighted sum of:
+#   - unassigned -- periods that couldn't be placed at all
+#   - bunching   -- periods of a subject beyond what a class should have in a day
+#                   (2 for block subjects, else an even spread of its periods per week),
+#                   and block subjects having 2 periods in a day that aren't back to back
+#   - ct_absent  -- days on which a class doesn't see its class teacher
+#   - gaps       -- free periods teachers sit through between their first and last period of a day
+#
+# Everything but `unassigned` is the sum of a cost for each day of each class and each
+# day of each teacher, so changing a timetable only needs the days of the classes and
+# teachers involved to be scored again. See optimize.py
+
+from math import ceil
+from utils import problem as prob
+
+WEIGHTS = {"unassigned": 1000, "bunching": 3, "ct_absent": 2, "gaps": 1}
+
+# The most periods of each subject a class should have in a day
+#
+# Returns a dictionary of class -> {subject: limit}
+def daily_limits(problem: prob.Problem):
+    limits = {cls: {} for cls in problem.classes}
+    for req in problem.requirements:
+        limits[req.class_name][req.subject] = 2 if req.intensity == "block" else max(ceil(req.per_week / len(prob.DAYS)), 1)
+    return limits
+
+# The subjects that are taught in blocks
+def block_subjects(problem: prob.Problem):
+    return {req.subject for req in problem.requirements if req.intensity == "block"}
+
+# The cost of one day of a class, as (bunching, ct_absent)
+#
+# @param cells         -- The day's 8 (subject, teacher) tuples or None
+# @param class_teacher -- The class teacher
+# @param limits        -- {subject: limit} for the class, from daily_limits()
+# @param blocks        -- Set of block subjects, from block_subjects()
+def class_day_cost(cells: list, class_teacher: str, limits: dict, blocks: set):
+    counts = {}
+    ct_present = class_teacher is None
+    for cell in cells:
+        if cell is not None:
+            counts[cell[0]] = counts.get(cell[0], 0) + 1
+            ct_present = ct_present or cell[1] == class_teacher
+
+    bunching = 0
+    for subject, count in counts.items():
+        bunching += max(count - limits.get(subject, 1), 0)
+        if count == 2 and subject in blocks:
+            first = next(i for i, cell in enumerate(cells) if cell and cell[0] == subject)
+            if not (cells[first + 1] and cells[first + 1][0] == subject):
+                bunching += 1 # Split block
+    return bunching, 0 if ct_present else 1
+
+# The cost of a class's whole row of the timetable, as (bunching, ct_absent)
+#
+# @param row -- List of 48 (subject, teacher) tuples or None
+def class_cost(row: list, class_teacher: str, limits: dict, blocks: set):
+    bunching = ct_absent = 0
+    for day in range(len(prob.DAYS)):
+        day_bunching, day_absent = class_day_cost(row[day * prob.PERIODS_PER_DAY:(day + 1) * prob.PERIODS_PER_DAY], class_teacher, limits, blocks)
+        bunching += day_bunching
+        ct_absent += day_absent
+    return bunching, ct_absent
+
+# The number of idle periods of a teacher between the first and last period of a day
+#
+# @param busy -- Bitset of the slots the teacher is busy in
+# @param day  -- Index of the day, 0 to 5
+def teacher_day_gaps(busy: int, day: int):
+    periods = (busy >> (day * prob.PERIODS_PER_DAY)) & ((1 << prob.PERIODS_PER_DAY) - 1)
+    if not periods:
+        return 0
+    # Span from the first to the last period, less the periods taught
+    span = periods.bit_length() - ((periods & -periods).bit_length() - 1)
+    return span - bin(periods).count("1")
+
+# The number of idle periods of a teacher in the week
+def teacher_gaps(busy: int):
+    return sum(teacher_day_gaps(busy, day) for day in range(len(prob.DAYS)))
+
+# Weighted total of the parts
+#
+# @param parts -- Dictionary having the same keys as WEIGHTS
+def total(parts: dict):
+    return sum(WEIGHTS[key] * value for key, value in parts.items())
+
+# Scores a whole timetable
+#
+# Returns (total, parts) where parts is a dictionary having the same keys as WEIGHTS
+#
+# @param tt         -- The engine.Timetable
+# @param unassigned -- Number of periods that couldn't be placed
+def score(problem: prob.Problem, tt, unassigned: int):
+    limits = daily_limits(problem)
+    blocks = block_subjects(problem)
+    parts = {"unassigned": unassigned, "bunching": 0, "ct_absent": 0, "gaps": 0}
+
+    for cls, row in tt.cells.items():
+        bunching, ct_absent = class_cost(row, problem.class_teachers.get(cls), limits[cls], blocks)
+        parts["bunching"] += bunching
+        parts["ct_absent"] += ct_absent
+
+    for busy in tt.teacher_busy.values():
+        parts["gaps"] += teacher_gaps(busy)
+
+    return total(parts), parts
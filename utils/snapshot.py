@@ -0,0 +1,160 @@
+# A compact binary copy of the timetable that opens instantly.
+#
+# ctt.csv and ttt.csv are meant to be read by people. Programs (like the GUI) read this
+# instead: the file is memory mapped, and a class's or teacher's timetable is found by
+# its position, so nothing else in the file is read or parsed.
+#
+# Layout, all numbers little endian:
+#   header        -- see HEADER: magic, version, slots a week, width of the names, number of
+#                    classes, teachers and labels, and where the class grids, teacher grids
+#                    and names start
+#   class grids   -- for each class, 48 pairs of (subject, teacher), as indices into the labels
+#   teacher grids -- for each teacher, 48 class indices
+#   names         -- IDs of the classes, then the teachers, then the labels, all as wide as
+#                    the longest of them (in bytes), padded with zeros
+# Labels are the subjects and teachers as the class grids show them, which for an elective
+# group are all of its subjects or teachers (see problem.py). Its teachers each have the
+# class in their own grid.
+# An index of EMPTY means a free period (or a period without a teacher).
+#
+# Class grids are written as the rows come in, so a whole timetable never needs to be
+# held. See prettyprint.export()
+#
+# A snapshot is written next to the old one and only takes its place once complete, so
+# programs that have the old one open (mapped) keep reading it safely.
+
+import mmap
+import os
+import struct
+from utils import problem as prob
+
+MAGIC = b"TTSN"
+VERSION = 3
+HEADER = struct.Struct("<4sHHHIIIIII")
+EMPTY = 0xFFFF
+
+_CLASS_GRID = struct.Struct(f"<{prob.SLOTS * 2}H")
+_TEACHER_GRID = struct.Struct(f"<{prob.SLOTS}H")
+
+# Writes a snapshot, a class at a time
+class Writer:
+    # @param file_path -- Where to save
+    def __init__(self, file_path: str):
+        self._file_path = file_path
+        self._file = open(file_path + ".tmp", "wb")
+        self._file.write(bytes(HEADER.size)) # Filled in by close()
+        self._names = {"classes": {}, "teachers": {}, "labels": {}}
+        self._teacher_grids = {}
+
+    # Index of an ID in its table of names, adding it if it's new
+    def _intern(self, table: str, name: str):
+        if name is None:
+            return EMPTY
+        names = self._names[table]
+        if name not in names:
+            names[name] = len(names)
+        return names[name]
+
+    # Adds a class's timetable. Each class may only be added once.
+    #
+    # @param cells -- List of 48 (subject, teacher) tuples or None
+    def add_class(self, class_name: str, cells: list):
+        class_index = self._intern("classes", class_name)
+        grid = []
+        for slot, cell in enumerate(cells):
+            if cell is None:
+                grid += [EMPTY, EMPTY]
+                continue
+            grid += [self._intern("labels", cell[0]), self._intern("labels", cell[1])]
+            if cell[1] is not None:
+                for teacher in prob.members(cell[1]):
+                    self._teacher_grids.setdefault(self._intern("teachers", teacher), [EMPTY] * prob.SLOTS)[slot] = class_index
+        self._file.write(_CLASS_GRID.pack(*grid))
+
+    # Writes the teacher grids and names and closes the file
+    def close(self):
+        class_grids = HEADER.size
+        teacher_grids = self._file.tell()
+        for teacher_index in range(len(self._names["teachers"])):
+            self._file.write(_TEACHER_GRID.pack(*self._teacher_grids[teacher_index]))
+
+        names = self._file.tell()
+        encoded = [name.encode() for table in ("classes", "teachers", "labels") for name in self._names[table]]
+        width = max(map(len, encoded), default=1)
+        for name in encoded:
+            self._file.write(name.ljust(width, b"\0"))
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, prob.SLOTS, width, len(self._names["classes"]), len(self._names["teachers"]),
+                                     len(self._names["labels"]), class_grids, teacher_grids, names))
+        self._file.close()
+        os.replace(self._file_path + ".tmp", self._file_path)
+
+    # Throws away what was written. The old snapshot, if any, stays
+    def discard(self):
+        self._file.close()
+        os.remove(self._file_path + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+# Writes a snapshot of an engine.Timetable
+#
+# @param file_path -- Where to save
+def save(file_path: str, tt):
+    with Writer(file_path) as writer:
+        for class_name in sorted(tt.cells):
+            writer.add_class(class_name, tt.cells[class_name])
+
+# An open snapshot
+class Snapshot:
+    # @param file_path -- Path to the snapshot. Raises ValueError if it isn't one
+    def __init__(self, file_path: str):
+        self._file = open(file_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, slots, width, n_classes, n_teachers, n_labels, self._class_grids, self._teacher_grids, names = HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or version != VERSION or slots != prob.SLOTS:
+            self.close()
+            raise ValueError(f"{file_path} is not a timetable snapshot this program can read.")
+
+        def read_names(start, count):
+            return [self._map[start + i * width:start + (i + 1) * width].rstrip(b"\0").decode() for i in range(count)]
+
+        self.classes = read_names(names, n_classes)
+        self.teachers = read_names(names + n_classes * width, n_teachers)
+        self._labels = read_names(names + (n_classes + n_teachers) * width, n_labels)
+        self._class_index = {name: i for i, name in enumerate(self.classes)}
+        self._teacher_index = {name: i for i, name in enumerate(self.teachers)}
+
+    # A class's timetable as a list of 48 (subject, teacher) tuples or None. KeyError if there's no such class.
+    def class_cells(self, class_name: str):
+        grid = _CLASS_GRID.unpack_from(self._map, self._class_grids + self._class_index[class_name] * _CLASS_GRID.size)
+        cells = []
+        for slot in range(prob.SLOTS):
+            subject, teacher = grid[2 * slot], grid[2 * slot + 1]
+            cells.append(None if subject == EMPTY else (self._labels[subject], None if teacher == EMPTY else self._labels[teacher]))
+        return cells
+
+    # A teacher's timetable as a list of 48 classes or None. KeyError if there's no such teacher.
+    def teacher_cells(self, teacher: str):
+        grid = _TEACHER_GRID.unpack_from(self._map, self._teacher_grids + self._teacher_index[teacher] * _TEACHER_GRID.size)
+        return [None if class_index == EMPTY else self.classes[class_index] for class_index in grid]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
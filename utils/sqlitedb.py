@@ -0,0 +1,115 @@
+# An embedded SQLite backend that behaves enough like mysql.connector for this program.
+#
+# The rest of the code is written for MySQL, so queries are translated on the way in:
+#   - `%s` placeholders become `?`
+#   - INSERT IGNORE becomes INSERT OR IGNORE
+#   - In CREATE TABLE, ENUMs become TEXT with a CHECK, AUTO_INCREMENT keys become
+#     INTEGER PRIMARY KEY AUTOINCREMENT and `Engine = InnoDB` is dropped
+#
+# Use it by putting this in `.json`
+#
+#     {"backend": "sqlite", "path": "timetable.db"}
+#
+# `path` may be ":memory:" for a database that lives only as long as the program.
+
+import re
+import sqlite3
+from functools import lru_cache
+
+Error = sqlite3.Error
+
+# Turns `day ENUM("mon", "tue")` into `day TEXT CHECK (day IN ('mon', 'tue'))`
+def _enum_to_check(match):
+    values = match.group(2).replace('"', "'")
+    return f"{match.group(1)} TEXT CHECK ({match.group(1)} IN ({values}))"
+
+# (pattern, replacement) pairs applied to every query, in order
+_RULES = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\bINSERT\s+IGNORE\b", re.IGNORECASE), "INSERT OR IGNORE"),
+    (re.compile(r"\)\s*Engine\s*=\s*\w+", re.IGNORECASE), ")"),
+    (re.compile(r"\w*INT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY", re.IGNORECASE), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"(\w+)\s+ENUM\s*\(([^)]*)\)", re.IGNORECASE), _enum_to_check),
+]
+
+# Translates a MySQL query to SQLite. The same few queries are run over and over, hence the cache.
+@lru_cache(maxsize=256)
+def translate(query: str):
+    for pattern, replacement in _RULES:
+        query = pattern.sub(replacement, query)
+    return query
+
+# Wraps a sqlite3 cursor to look like a mysql.connector one
+class Cursor:
+    # @param cursor     -- The sqlite3 cursor
+    # @param dictionary -- Return rows as dictionaries of column -> value, like cursor(dictionary=True) in mysql.connector
+    def __init__(self, cursor, dictionary: bool = False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def execute(self, query: str, params=()):
+        self._cursor.execute(translate(query), tuple(params or ()))
+        return self
+
+    def executemany(self, query: str, seq_params):
+        self._cursor.executemany(translate(query), (tuple(params) for params in seq_params))
+        return self
+
+    def _row(self, row):
+        if self._dictionary and row is not None:
+            return {column[0]: value for column, value in zip(self._cursor.description, row)}
+        return row
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int = 1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+# Wraps a sqlite3 connection to look like a mysql.connector one
+class Connection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    # `buffered` is accepted for compatibility. SQLite cursors can always be read at leisure.
+    def cursor(self, buffered: bool = False, dictionary: bool = False):
+        return Cursor(self._conn.cursor(), dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+# Opens (or creates) a SQLite database
+#
+# @param path -- Path to the database file or ":memory:"
+def connect(path: str):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return Connection(conn)
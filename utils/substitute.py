@@ -0,0 +1,100 @@
+# Finds substitutes for the periods of absent teachers on a day.
+#
+# The timetable is loaded once into an engine.Timetable, whose bitsets (one per teacher,
+# a bit for each slot of the week) say who is free when in a single operation. For each
+# period of an absent teacher, the free teachers are ranked by:
+#   1. Whether they teach the same subject
+#   2. How many periods they have that day, substitutions given so far included
+#   3. How many substitutions they were given so far, then their serial number, so the
+#      same few teachers aren't picked every time
+# The best one is picked, and the next few are listed in case they aren't around either.
+
+import csv
+import time
+from collections import namedtuple
+from utils import logmaster
+from utils import engine
+from utils import problem as prob
+from utils import instrument
+
+_log = logmaster.getLogger()
+
+# A period of an absent teacher and who could take it
+#
+# @field period     -- Period number on the day, 1 to 8
+# @field class_name -- ID of class
+# @field subject    -- ID of subject
+# @field absent     -- ID of the absent teacher
+# @field substitute -- ID of the teacher picked, or None if nobody is free
+# @field candidates -- Tuple of the best few teachers free then, best first. Includes `substitute`
+Substitution = namedtuple("Substitution", ["period", "class_name", "subject", "absent", "substitute", "candidates"])
+
+# Loads what finding substitutes needs. Do it once and call find_substitutes() as often as needed.
+#
+# Returns (problem, timetable, serials) where serials is a dictionary of teacher -> serial number
+#
+# @param cursor -- A cursor to read from
+@instrument.timed
+def load(cursor):
+    problem = prob.load_problem(cursor)
+    tt = engine.load_timetable(cursor, problem)
+    cursor.execute("SELECT ID, serial FROM teachers;")
+    serials = {teacher: serial for teacher, serial in cursor.fetchall()}
+    return problem, tt, serials
+
+# Proposes substitutes for every period of the absent teachers on a day
+#
+# Returns a list of Substitution in the order of the day
+#
+# @param absent    -- IDs of the absent teachers
+# @param day       -- day Eg: "mon", "tue" ...
+# @param shortlist -- How many candidates to list for each period
+@instrument.timed
+def find_substitutes(problem: prob.Problem, tt: engine.Timetable, serials: dict, absent: list, day: str, shortlist: int = 3):
+    start = time.perf_counter()
+    absent = sorted(set(absent))
+    first = prob.slot_of(day, 1)
+    day_mask = ((1 << prob.PERIODS_PER_DAY) - 1) << first
+
+    present = [teacher for teacher in problem.teacher_subject if teacher not in absent]
+    # Copies, since substitutions make teachers busy too
+    busy = {teacher: tt.teacher_busy.get(teacher, 0) for teacher in present}
+    load = {teacher: bin(busy[teacher] & day_mask).count("1") for teacher in present}
+    given = {teacher: 0 for teacher in present}
+
+    substitutions = []
+    for slot in range(first, first + prob.PERIODS_PER_DAY):
+        for teacher in absent:
+            class_name = tt.teacher_cells.get(teacher, {}).get(slot)
+            if class_name is None:
+                continue
+            subject = prob.subject_of(tt.cells[class_name][slot], teacher)
+
+            free = [t for t in present if not (busy[t] >> slot) & 1]
+            free.sort(key = lambda t: (problem.teacher_subject[t] != subject, load[t], given[t], serials.get(t, 0)))
+            substitute = free[0] if free else None
+            if substitute is None:
+                _log.warning("Nobody is free to take %s for %s in period %s.", class_name, teacher, slot - first + 1)
+            else:
+                busy[substitute] |= 1 << slot
+                load[substitute] += 1
+                given[substitute] += 1
+
+            substitutions.append(Substitution(slot - first + 1, class_name, subject, teacher, substitute, tuple(free[:shortlist])))
+
+    _log.info("Found substitutes for %s periods of %s absent teachers in %.1fms.",
+              len(substitutions), len(absent), (time.perf_counter() - start) * 1000)
+    return substitutions
+
+# Saves substitutions to a CSV file
+#
+# @param file_path     -- Where to save
+# @param substitutions -- List of Substitution, from find_substitutes()
+def save(file_path: str, substitutions: list):
+    with open(file_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Period", "Class", "Subject", "Absent", "Substitute", "Others free"])
+        for sub in substitutions:
+            writer.writerow([sub.period, sub.class_name, sub.subject, sub.absent, sub.substitute or "",
+                             " ".join(t for t in sub.candidates if t != sub.substitute)])
+    _log.info("Saved substitutions to %s", file_path)
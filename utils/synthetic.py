@@ -0,0 +1,125 @@
+# Makes up the CSV files of a school of any size, for benchmarks and trying things out.
+#
+# The real CSV files can't be shared, so this writes subjects.csv, teachers.csv,
+# periodsperweek.csv and subjectdata.csv in the same format (see db.update_db()).
+# Every class gets 48 periods a week. Some classes choose between optional subjects
+# (Eg: "SAN/FRE" in subjectdata.csv); generate() returns the choices so they can be
+# given to db.set_optional_subjects() and nobody has to be asked.
+#
+# NOTES:
+# Sections go A to Z, then AA, AB ... Campuses are C1-, C2- ... before the grade, if more than one.
+# Eg: C2-10AB. See problem.parse_class(). Class IDs are 8 characters at most.
+# Teacher IDs are "T" and 2 base 36 digits, so up to 1296 teachers.
+
+import csv
+import os
+import random
+from math import ceil
+from utils import logmaster
+
+_log = logmaster.getLogger()
+
+# (ID, name, intensity, periods per week). Adds up to 48 with one subject of each optional pair
+SUBJECTS = [
+    ("ENG", "English", "single", 8),
+    ("MAT", "Mathematics", "single", 8),
+    ("SCI", "Science", "block", 8),
+    ("SST", "Social Science", "single", 7),
+    ("HIN", "Hindi", "single", 6),
+    ("SAN", "Sanskrit", "single", 4),
+    ("FRE", "French", "single", 4),
+    ("CS", "Computer Science", "block", 2),
+    ("ART", "Art", "block", 2),
+    ("PE", "Physical Education", "single", 3),
+    ("CCA", "Co-Curricular Activities", "single", 2),
+]
+
+# Optional subjects, one of which a class takes. Classes without the choice take the first.
+OPTIONAL = [("SAN", "FRE"), ("CS", "ART")]
+
+_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Teacher ID of the n-th teacher, n from 0. Eg: T00, T01, ... T0Z, T10 ...
+def teacher_id(n: int):
+    return "T" + _DIGITS[n // 36] + _DIGITS[n % 36]
+
+# Name of the n-th section, n from 0. Eg: A, B, ... Z, AA, AB ...
+def section_name(n: int):
+    name = ""
+    n += 1
+    while n:
+        n, letter = divmod(n - 1, 26)
+        name = chr(ord("A") + letter) + name
+    return name
+
+# Writes the CSV files of a made up school
+#
+# Returns the choices between optional subjects, for db.set_optional_subjects()
+#
+# @param out_dir      -- Directory to write the CSV files to. Made if it doesn't exist
+# @param grades       -- The grades. Eg: range(6, 13)
+# @param sections     -- Number of sections in each grade (classes A, B, C ...)
+# @param campuses     -- Number of campuses, each having all the grades and sections
+# @param teacher_load -- Periods a week each teacher is meant to have. Lower means more teachers
+# @param electives    -- Share of classes that choose between optional subjects, 0 to 1
+# @param seed         -- Seed for the random choices
+def generate(out_dir: str, grades = range(6, 11), sections: int = 5, teacher_load: int = 30, electives: float = 0.5, seed: int = 0, campuses: int = 1):
+    rng = random.Random(seed)
+    per_week = {subject: periods for subject, _, _, periods in SUBJECTS}
+    pairs = {pair[0]: pair for pair in OPTIONAL}
+    # Columns of subjectdata.csv. The first of each pair of optional subjects stands for the pair
+    columns = [subject for subject in per_week if subject in pairs or all(subject not in pair for pair in OPTIONAL)]
+    prefixes = [f"C{campus + 1}-" for campus in range(campuses)] if campuses > 1 else [""]
+    classes = [f"{prefix}{grade}{section_name(section)}" for prefix in prefixes for grade in grades for section in range(sections)]
+
+    # What each class takes, and the choices made
+    rows = []
+    choices = {}
+    periods = {subject: 0 for subject in per_week} # Periods a week of each subject in the whole school
+    for cls in classes:
+        choosing = rng.random() < electives
+        row = [cls]
+        for subject in columns:
+            if subject in pairs and choosing:
+                options = "/".join(pairs[subject])
+                row.append(options)
+                subject = rng.choice(pairs[subject])
+                choices.setdefault(cls, {})[options] = subject
+            else:
+                row.append(subject)
+            periods[subject] += per_week[subject]
+        rows.append(row)
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "subjects.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["ID", "name", "intensity"])
+        writer.writerows((subject, name, intensity) for subject, name, intensity, _ in SUBJECTS)
+
+    with open(os.path.join(out_dir, "periodsperweek.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["grade", "subject", "per_week"])
+        writer.writerows((grade, subject, periods) for grade in grades for subject, _, _, periods in SUBJECTS)
+
+    with open(os.path.join(out_dir, "subjectdata.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["class"] + columns)
+        writer.writerows(rows)
+
+    # Enough teachers of each subject for their load. CCA is taken by the class teacher.
+    needed = {subject: ceil(count / teacher_load) for subject, count in periods.items() if subject != "CCA"}
+    if sum(needed.values()) > len(_DIGITS) ** 2:
+        raise ValueError(f"{sum(needed.values())} teachers are too many to have 3 character IDs. Raise teacher_load.")
+    teachers = []
+    for subject, count in needed.items():
+        for _ in range(count):
+            teachers.append((teacher_id(len(teachers)), f"Teacher {len(teachers) + 1}", subject))
+
+    with open(os.path.join(out_dir, "teachers.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["ID", "name", "subject", "qualification", "role", "serial"])
+        # serial is a TINYINT, so it wraps around after 127
+        writer.writerows((teacher, name, subject, "TGT", "", i % 127 + 1) for i, (teacher, name, subject) in enumerate(teachers))
+
+    _log.info("Made up a school of %s classes and %s teachers in %s.", len(classes), len(teachers), out_dir)
+    return choices